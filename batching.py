@@ -0,0 +1,58 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# Datastore limits: values in one IN filter, keys in one lookup and
+# mutations in one commit.
+IN_FILTER_LIMIT = 30
+GET_MULTI_LIMIT = 1000
+PUT_MULTI_LIMIT = 500
+MAX_PARALLEL_QUERIES = 8
+
+_query_pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL_QUERIES)
+
+
+def chunked(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _map(fn, values):
+    # Each task runs in a copy of the caller's context, so code in the pool
+    # still sees the Flask request it is serving.
+    futures = [_query_pool.submit(contextvars.copy_context().run, fn, value) for value in values]
+    return [future.result() for future in futures]
+
+
+def unique(values):
+    return list(dict.fromkeys(values))
+
+
+def fetch_in(client, kind, property_name, values):
+    values = unique(values)
+    entities_by_value = {value: [] for value in values}
+    if not values:
+        return entities_by_value
+
+    def fetch_chunk(chunk):
+        query = client.query(kind=kind)
+        query.add_filter(property_name, "IN", chunk)
+        return list(query.fetch())
+
+    # One IN query per chunk, issued concurrently, so latency stays at roughly
+    # one round trip until the input outgrows IN_FILTER_LIMIT * MAX_PARALLEL_QUERIES.
+    for entities in _map(fetch_chunk, list(chunked(values, IN_FILTER_LIMIT))):
+        for entity in entities:
+            entities_by_value.setdefault(entity[property_name], []).append(entity)
+    return entities_by_value
+
+
+def get_multi(client, keys):
+    entities = []
+    for batch in _map(client.get_multi, list(chunked(keys, GET_MULTI_LIMIT))):
+        entities.extend(batch)
+    return entities
+
+
+def put_multi(client, entities):
+    for chunk in chunked(list(entities), PUT_MULTI_LIMIT):
+        client.put_multi(chunk)
@@ -0,0 +1,77 @@
+"""Scalar per-store haversine loop vs. the vectorized kernel in geo.py.
+
+    python benchmarks/bench_haversine.py --sizes 1000,10000,100000,1000000
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geo  # noqa: E402
+
+
+def distance_calculation(lat1, lon1, lat2, lon2):
+    radius = 6371
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    equation = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(equation), math.sqrt(1 - equation))
+    return radius * c
+
+
+def scalar_filter(user_lat, user_lon, lats, lons, radius):
+    nearby = []
+    for index, (lat, lon) in enumerate(zip(lats, lons)):
+        distance = distance_calculation(user_lat, user_lon, lat, lon)
+        if distance <= radius:
+            nearby.append((distance, index))
+    nearby.sort()
+    return [index for _, index in nearby]
+
+
+def best_of(repeat, fn, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--radius", type=float, default=25.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=467)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    user_lat, user_lon = 44.56, -123.28
+
+    print(f"{'stores':>9} {'scalar ms':>10} {'kernel ms':>10} {'index ms':>9} {'speedup':>8} {'matches':>8}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        lats = np.ascontiguousarray(rng.uniform(42.0, 47.0, size))
+        lons = np.ascontiguousarray(rng.uniform(-125.0, -117.0, size))
+        lat_list, lon_list = lats.tolist(), lons.tolist()
+
+        scalar_ms, expected = best_of(args.repeat, scalar_filter, user_lat, user_lon, lat_list, lon_list, args.radius)
+        kernel_ms, (_, _, order) = best_of(args.repeat, geo.within_radius, user_lat, user_lon, lats, lons, args.radius)
+        assert order.tolist() == expected
+
+        index = geo.GridIndex()
+        for store_id, (lat, lon) in enumerate(zip(lat_list, lon_list)):
+            index.add(store_id, lat, lon)
+        index.coordinates()
+        index_ms, _ = best_of(args.repeat, index.within, user_lat, user_lon, args.radius)
+
+        print(f"{size:>9} {scalar_ms:>10.2f} {kernel_ms:>10.2f} {index_ms:>9.2f} {scalar_ms / kernel_ms:>7.1f}x {len(expected):>8}")
+
+
+if __name__ == "__main__":
+    main()
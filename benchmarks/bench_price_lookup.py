@@ -0,0 +1,115 @@
+"""Compare per-item price queries with the batched lookup in pricing.py.
+
+Runs against a simulated Datastore client that sleeps for a fixed latency on
+every RPC, so the numbers show how RPC count and wall time grow with the
+length of the shopping list.
+
+    python benchmarks/bench_price_lookup.py --latency-ms 20
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pricing  # noqa: E402
+
+
+class SimulatedQuery:
+    def __init__(self, client, kind):
+        self.client = client
+        self.kind = kind
+        self.filters = []
+
+    def add_filter(self, name, operator, value):
+        self.filters.append((name, operator, value))
+
+    def fetch(self):
+        self.client.record_rpc()
+        rows = self.client.rows[self.kind]
+        for name, operator, value in self.filters:
+            if operator == "=":
+                rows = [row for row in rows if row.get(name) == value]
+            elif operator == "IN":
+                values = set(value)
+                rows = [row for row in rows if row.get(name) in values]
+        return iter(rows)
+
+
+class SimulatedClient:
+    def __init__(self, rows, latency):
+        self.rows = rows
+        self.latency = latency
+        self.rpcs = 0
+        self._lock = threading.Lock()
+
+    def record_rpc(self):
+        with self._lock:
+            self.rpcs += 1
+        time.sleep(self.latency)
+
+    def query(self, kind):
+        return SimulatedQuery(self, kind)
+
+
+def make_prices(items, stores, seed):
+    rng = random.Random(seed)
+    prices = []
+    for item_id in range(1, items + 1):
+        for store_id in rng.sample(range(1, stores + 1), k=min(stores, 5)):
+            prices.append({
+                "item_id": item_id,
+                "store_id": store_id,
+                "price": round(rng.uniform(0.5, 20.0), 2),
+                "sale_status": rng.random() < 0.1,
+                "timestamp": None,
+            })
+    return {"Price": prices}
+
+
+def legacy_comparison(client, shopping_list):
+    comparison = {}
+    for item in shopping_list:
+        query = client.query(kind="Price")
+        query.add_filter("item_id", "=", item)
+        prices = list(query.fetch())
+        comparison[item] = min(prices, key=lambda x: x["price"]) if prices else None
+    return comparison
+
+
+def batched_comparison(client, shopping_list):
+    return pricing.best_prices(pricing.fetch_prices_for_items(client, shopping_list))
+
+
+def measure(client, fn, shopping_list):
+    client.rpcs = 0
+    start = time.perf_counter()
+    fn(client, shopping_list)
+    return client.rpcs, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--stores", type=int, default=50)
+    parser.add_argument("--sizes", default="1,5,10,20,40,50,100,200")
+    parser.add_argument("--seed", type=int, default=467)
+    args = parser.parse_args()
+
+    client = SimulatedClient(make_prices(args.items, args.stores, args.seed), args.latency_ms / 1000)
+    rng = random.Random(args.seed)
+
+    print(f"{'items':>6} {'legacy rpcs':>12} {'legacy ms':>10} {'batched rpcs':>13} {'batched ms':>11}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        shopping_list = rng.sample(range(1, args.items + 1), k=min(size, args.items))
+        legacy_rpcs, legacy_ms = measure(client, legacy_comparison, shopping_list)
+        batched_rpcs, batched_ms = measure(client, batched_comparison, shopping_list)
+        print(f"{size:>6} {legacy_rpcs:>12} {legacy_ms:>10.1f} {batched_rpcs:>13} {batched_ms:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
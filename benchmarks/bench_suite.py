@@ -0,0 +1,199 @@
+"""Scale curves for the pricing and geo hot paths in main.py.
+
+For each scale (stores:items:price reports) the suite fills an in-memory
+storage backend with datagen.py, then times distance_calculation,
+get_nearby_stores, get_price_comparison, calculate_best_store and
+get_items_by_store. It records wall time, storage RPCs and peak Python
+memory per call, and writes everything as JSON for comparing runs.
+
+    python benchmarks/bench_suite.py --scales 1000:10000:100000,10000:100000:1000000 --output suite.json
+
+The largest scale the generator supports, 100000:1000000:10000000, needs
+tens of GB of RAM with the in-memory backend.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("JOB_WORKERS", "0")
+
+import datagen  # noqa: E402
+from bench_haversine import distance_calculation  # noqa: E402
+import main as app_main  # noqa: E402
+import storage  # noqa: E402
+
+
+# Memory backend that counts the calls that would each be one Datastore RPC.
+class CountingClient(storage.MemoryClient):
+    def __init__(self):
+        super().__init__()
+        self.rpcs = 0
+
+    def get_multi(self, keys, missing=None):
+        self.rpcs += 1
+        return super().get_multi(keys, missing=missing)
+
+    def _apply(self, puts, deletes):
+        self.rpcs += 1
+        return super()._apply(puts, deletes)
+
+    def _run_query(self, query, limit, offset, start_cursor):
+        self.rpcs += 1
+        return super()._run_query(query, limit, offset, start_cursor)
+
+
+def use_client(client):
+    app_main.datastore_client = client
+    app_main.job_runner.client = client
+    app_main.entity_cache.clear()
+    app_main.store_locator.invalidate()
+
+
+def scan_all_stores(user_location, coordinates):
+    # What every nearby-store lookup cost before the grid index: one scalar
+    # distance per store.
+    user_lat, user_lon = user_location
+    return sum(1 for lat, lon in coordinates if distance_calculation(user_lat, user_lon, lat, lon) <= 25)
+
+
+def items_by_store(store_id):
+    with app_main.app.test_request_context(f"/api/store/{store_id}/items"):
+        return app_main.get_items_by_store(store_id)
+
+
+def measure(client, calls, cold):
+    # Timing and memory come from separate passes; tracemalloc slows calls down.
+    timings = []
+    rpcs = []
+    for fn, args in calls:
+        if cold:
+            app_main.entity_cache.clear()
+        client.rpcs = 0
+        start = time.perf_counter()
+        fn(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+        rpcs.append(client.rpcs)
+
+    peak = 0
+    tracemalloc.start()
+    for fn, args in calls[:3]:
+        if cold:
+            app_main.entity_cache.clear()
+        tracemalloc.reset_peak()
+        fn(*args)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    ordered = sorted(timings)
+    return {
+        "calls": len(calls),
+        "wall_ms_mean": statistics.mean(timings),
+        "wall_ms_p50": ordered[len(ordered) // 2],
+        "wall_ms_max": ordered[-1],
+        "rpcs_per_call": statistics.mean(rpcs),
+        "peak_memory_kb": peak / 1024,
+    }
+
+
+def user_locations(rng, count):
+    locations = []
+    for _ in range(count):
+        metro_lat, metro_lon = rng.choice(datagen.METROS)
+        locations.append((rng.gauss(metro_lat, 0.2), rng.gauss(metro_lon, 0.2)))
+    return locations
+
+
+def run_scale(stores, items, prices, args):
+    client = CountingClient()
+    start = time.perf_counter()
+    data = datagen.generate(client, stores, items, prices, seed=args.seed)
+    generate_seconds = time.perf_counter() - start
+    use_client(client)
+    coordinates = list(data["store_coordinates"].values())
+
+    rng = random.Random(args.seed)
+    locations = user_locations(rng, args.calls)
+    # Lists lean on the popular items, like real shopping lists would.
+    popular = max(1, items // 5)
+    shopping_lists = [[rng.randint(1, popular) for _ in range(args.list_size)] for _ in range(args.calls)]
+    store_ids = [rng.randint(1, stores) for _ in range(args.calls)]
+
+    start = time.perf_counter()
+    app_main.store_locator.coordinates()
+    locator_build_ms = (time.perf_counter() - start) * 1000
+
+    cases = {
+        "distance_calculation": [(scan_all_stores, (location, coordinates)) for location in locations[:max(1, args.calls // 10)]],
+        "get_nearby_stores": [(app_main.get_nearby_stores, (location,)) for location in locations],
+        "get_price_comparison": [(app_main.get_price_comparison, (shopping_list,)) for shopping_list in shopping_lists],
+        "calculate_best_store": [(app_main.calculate_best_store, (shopping_list, location)) for shopping_list, location in zip(shopping_lists, locations)],
+        "get_items_by_store": [(items_by_store, (store_id,)) for store_id in store_ids],
+    }
+    results = []
+    scale = {"stores": stores, "items": items, "prices": prices, "price_summaries": data["price_summaries"]}
+    for name, calls in cases.items():
+        if args.only and name not in args.only:
+            continue
+        result = {"function": name, "scale": scale}
+        result.update(measure(client, calls, cold=not args.warm))
+        results.append(result)
+        print(f"{stores:>7} {items:>8} {prices:>9} {name:<22} {result['wall_ms_mean']:>9.2f} {result['wall_ms_p50']:>9.2f} "
+              f"{result['rpcs_per_call']:>6.1f} {result['peak_memory_kb']:>9.0f}", flush=True)
+    return {"scale": scale, "generate_seconds": generate_seconds, "locator_build_ms": locator_build_ms, "results": results}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default="1000:10000:100000,10000:100000:1000000",
+                        help="comma-separated stores:items:prices triples")
+    parser.add_argument("--calls", type=int, default=50, help="calls per function and scale")
+    parser.add_argument("--list-size", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=467)
+    parser.add_argument("--warm", action="store_true", help="keep the entity cache between calls")
+    parser.add_argument("--only", type=lambda value: value.split(","), help="comma-separated function names")
+    parser.add_argument("--output", default="bench_suite.json")
+    args = parser.parse_args()
+
+    print(f"{'stores':>7} {'items':>8} {'prices':>9} {'function':<22} {'mean ms':>9} {'p50 ms':>9} {'rpcs':>6} {'peak kB':>9}")
+    runs = []
+    for scale in args.scales.split(","):
+        stores, items, prices = (int(value) for value in scale.split(":"))
+        runs.append(run_scale(stores, items, prices, args))
+
+    report = {
+        "created": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "calls": args.calls,
+        "list_size": args.list_size,
+        "cache": "warm" if args.warm else "cold",
+        "runs": runs,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Seeded synthetic data for benchmarks: stores, items and price reports.
+
+Stores are clustered around a handful of metro areas, items get a base price
+and a few stocking stores each, and price reports arrive in time order so the
+PriceSummary and PriceHistory entities come out the same as the live write
+path would build them. The same seed always produces the same data.
+
+    python benchmarks/datagen.py --stores 1000 --items 10000 --prices 100000 --sqlite data.sqlite3
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.cloud import datastore  # noqa: E402
+
+import batching  # noqa: E402
+import price_history  # noqa: E402
+import pricing  # noqa: E402
+import storage  # noqa: E402
+
+METROS = [
+    (45.52, -122.68), (44.05, -123.09), (44.56, -123.28), (47.61, -122.33), (37.77, -122.42),
+    (34.05, -118.24), (40.71, -74.01), (41.88, -87.63), (29.76, -95.37), (39.74, -104.99),
+]
+BRANDS = [f"brand-{index:03d}" for index in range(200)]
+TAGS = ["produce", "dairy", "bakery", "frozen", "snacks", "beverages", "household", "organic", "meat", "pantry"]
+STORES_PER_ITEM = 5
+REPORT_WINDOW = datetime.timedelta(days=60)
+
+
+def _put_all(client, entities, batch_size=batching.PUT_MULTI_LIMIT):
+    batch = []
+    for entity in entities:
+        batch.append(entity)
+        if len(batch) >= batch_size:
+            client.put_multi(batch)
+            batch = []
+    if batch:
+        client.put_multi(batch)
+
+
+def generate_stores(client, count, rng, now):
+    coordinates = {}
+    entities = []
+    for store_id in range(1, count + 1):
+        metro_lat, metro_lon = rng.choice(METROS)
+        latitude = round(rng.gauss(metro_lat, 0.25), 6)
+        longitude = round(rng.gauss(metro_lon, 0.25), 6)
+        coordinates[store_id] = (latitude, longitude)
+        store = datastore.Entity(key=client.key("Store", store_id))
+        store.update({
+            "name": f"Store {store_id}",
+            "location": f"{latitude}, {longitude}",
+            "latitude": latitude,
+            "longitude": longitude,
+            "timestamp": now,
+        })
+        entities.append(store)
+    _put_all(client, entities)
+    return coordinates
+
+
+def generate_items(client, count, rng, now):
+    base_prices = {}
+
+    def items():
+        for item_id in range(1, count + 1):
+            base_prices[item_id] = round(rng.lognormvariate(1.2, 0.7), 2)
+            item = datastore.Entity(key=client.key("Item", item_id))
+            item.update({
+                "name": f"Item {item_id}",
+                "barcode": f"{item_id:012d}",
+                "brand": rng.choice(BRANDS),
+                "tags": rng.sample(TAGS, k=rng.randint(0, 3)),
+                "timestamp": now,
+            })
+            yield item
+
+    _put_all(client, items())
+    return base_prices
+
+
+# Streams reports in time order and folds them into PriceSummary and
+# PriceHistory entities; raw Price entities are only written when raw_prices
+# is set, since at 10M reports they dominate memory and none of the
+# benchmarked paths read them.
+def generate_prices(client, count, stores, base_prices, rng, now, raw_prices=False):
+    store_ids = list(stores)
+    item_ids = list(base_prices)
+    store_factor = {store_id: rng.uniform(0.85, 1.2) for store_id in store_ids}
+    stocking = {}
+    summaries = {}
+    series = {}
+    start = now - REPORT_WINDOW
+    step = REPORT_WINDOW / max(count, 1)
+    raw = []
+
+    for index in range(count):
+        # Popularity is skewed: the first fifth of the items get 80% of the reports.
+        if rng.random() < 0.8:
+            item_id = item_ids[rng.randrange(max(1, len(item_ids) // 5))]
+        else:
+            item_id = item_ids[rng.randrange(len(item_ids))]
+        if item_id not in stocking:
+            stocking[item_id] = rng.sample(store_ids, k=min(STORES_PER_ITEM, len(store_ids)))
+        store_id = rng.choice(stocking[item_id])
+        sale_status = rng.random() < 0.1
+        price = round(base_prices[item_id] * store_factor[store_id] * rng.uniform(0.95, 1.05) * (0.8 if sale_status else 1.0), 2)
+        timestamp = start + step * index
+
+        name = pricing.summary_key_name(item_id, store_id)
+        summary = summaries.get(name)
+        if summary is None:
+            summary = datastore.Entity(key=client.key("PriceSummary", name), exclude_from_indexes=pricing.SUMMARY_UNINDEXED)
+            summaries[name] = summary
+            series[name] = price_history.PriceSeries()
+        pricing.apply_price_observation(summary, item_id, store_id, price, sale_status, timestamp)
+        series[name].add(timestamp, price, sale_status)
+
+        if raw_prices:
+            report = datastore.Entity(key=client.key("Price"))
+            report.update({"item_id": item_id, "store_id": store_id, "price": price, "user_id": 0, "sale_status": sale_status, "timestamp": timestamp})
+            raw.append(report)
+            if len(raw) >= batching.PUT_MULTI_LIMIT:
+                client.put_multi(raw)
+                raw = []
+    if raw:
+        client.put_multi(raw)
+    _put_all(client, summaries.values())
+    _put_all(client, (
+        price_history.history_entity(client.key("PriceHistory", name), summary["item_id"], summary["store_id"],
+                                     series[name], summary["observation_count"])
+        for name, summary in summaries.items()
+    ))
+    return len(summaries)
+
+
+def generate(client, stores, items, prices, seed=0, raw_prices=False):
+    rng = random.Random(seed)
+    now = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    coordinates = generate_stores(client, stores, rng, now)
+    base_prices = generate_items(client, items, rng, now)
+    summary_count = generate_prices(client, prices, coordinates, base_prices, rng, now, raw_prices=raw_prices)
+    return {
+        "stores": stores,
+        "items": items,
+        "prices": prices,
+        "price_summaries": summary_count,
+        "store_coordinates": coordinates,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stores", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--prices", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=467)
+    parser.add_argument("--raw-prices", action="store_true", help="also write every report as a Price entity")
+    parser.add_argument("--sqlite", required=True, help="SQLite file to fill (see STORAGE_BACKEND=sqlite)")
+    args = parser.parse_args()
+
+    client = storage.SQLiteClient(args.sqlite)
+    start = time.perf_counter()
+    data = generate(client, args.stores, args.items, args.prices, seed=args.seed, raw_prices=args.raw_prices)
+    print(f"{data['stores']} stores, {data['items']} items, {data['prices']} reports "
+          f"({data['price_summaries']} summaries) in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
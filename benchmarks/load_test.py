@@ -0,0 +1,257 @@
+"""HTTP load harness with per-route throughput and latency percentiles.
+
+Worker threads replay a weighted mix of user flows for a fixed duration:
+browsing /api/stores, opening store catalogs, scanning items, editing
+shopping lists, asking /recommend_store and typing item searches. Every request's latency is
+recorded under its route pattern, and the report shows throughput and
+p50/p95/p99 for each route.
+
+Without --url the app is served in this process from an in-memory backend
+seeded by datagen.py, which keeps the run self-contained but shares the GIL
+with the load generator. For numbers closer to production, seed a SQLite
+file with datagen.py, start `STORAGE_BACKEND=sqlite python main.py` and
+point --url at it.
+
+    python benchmarks/load_test.py --concurrency 16 --duration 30
+    python benchmarks/load_test.py --url http://127.0.0.1:8080 --mix recommend=1
+"""
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen  # noqa: E402
+
+FLOWS = ("browse", "catalog", "scan", "shopping_list", "recommend", "search")
+DEFAULT_MIX = "browse=25,catalog=25,scan=15,shopping_list=15,recommend=10,search=10"
+USERS = 1000
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.statuses = {}
+
+    def record(self, route, status, seconds):
+        with self._lock:
+            self.samples.setdefault(route, []).append(seconds * 1000)
+            counts = self.statuses.setdefault(route, {})
+            counts[status] = counts.get(status, 0) + 1
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Session:
+    def __init__(self, base_url, recorder, rng, scale):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.recorder = recorder
+        self.rng = rng
+        self.scale = scale
+        self.user_id = rng.randint(1, USERS)
+
+    def request(self, method, path, route, body=None):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            payload, status = b"", "error"
+        finally:
+            connection.close()
+        self.recorder.record(f"{method} {route}", status, time.perf_counter() - start)
+        if status != "error" and payload and payload[:1] in (b"{", b"["):
+            try:
+                return json.loads(payload)
+            except ValueError:
+                return None
+        return None
+
+    def popular_item(self):
+        return self.rng.randint(1, max(1, self.scale["items"] // 5))
+
+    def location(self):
+        metro_lat, metro_lon = self.rng.choice(datagen.METROS)
+        return [self.rng.gauss(metro_lat, 0.2), self.rng.gauss(metro_lon, 0.2)]
+
+    def browse(self):
+        page = self.request("GET", "/api/stores?limit=50", "/api/stores")
+        # Some users page further through the directory.
+        while page and page.get("next_cursor") and self.rng.random() < 0.3:
+            cursor = urllib.parse.quote(page["next_cursor"])
+            page = self.request("GET", f"/api/stores?limit=50&cursor={cursor}", "/api/stores")
+
+    def catalog(self):
+        store_id = self.rng.randint(1, self.scale["stores"])
+        page = self.request("GET", f"/api/store/{store_id}/items?limit=50", "/api/store/<store_id>/items")
+        if page and page.get("items"):
+            item = self.rng.choice(page["items"])
+            self.request("GET", f"/api/item/{item['id']}", "/api/item/<item_id>")
+
+    def scan(self):
+        if self.rng.random() < 0.9:
+            barcode = f"{self.popular_item():012d}"
+        else:
+            barcode = f"9{self.rng.randrange(10 ** 11):011d}"
+        self.request("POST", "/api/scan", "/api/scan", {
+            "barcode": barcode,
+            "price": round(self.rng.uniform(0.5, 20.0), 2),
+            "sale_status": self.rng.random() < 0.1,
+            "tags": self.rng.sample(datagen.TAGS, k=self.rng.randint(0, 2)),
+            "user_id": self.user_id,
+        })
+
+    def shopping_list(self):
+        item_id = self.popular_item()
+        self.request("POST", "/api/shoppinglist", "/api/shoppinglist", {"user_id": self.user_id, "item_id": item_id})
+        self.request("GET", f"/api/shoppinglist/{self.user_id}", "/api/shoppinglist/<user_id>")
+        if self.rng.random() < 0.2:
+            self.request("DELETE", f"/api/shoppinglist/{self.user_id}/remove/{item_id}", "/api/shoppinglist/<user_id>/remove/<item_id>")
+
+    def recommend(self):
+        self.request("POST", "/recommend_store", "/recommend_store", {
+            "shopping_list": [self.popular_item() for _ in range(self.rng.randint(5, 20))],
+            "user_location": self.location(),
+        })
+
+    def search(self):
+        # One request per keystroke, as a typeahead box would send them.
+        query = self.rng.choice([self.rng.choice(datagen.TAGS), self.rng.choice(datagen.BRANDS), f"item {self.popular_item()}"])
+        for end in range(2, len(query) + 1, 2):
+            self.request("GET", f"/api/items/search?q={urllib.parse.quote(query[:end])}&limit=10", "/api/items/search")
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in FLOWS:
+            raise argparse.ArgumentTypeError(f"unknown flow: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def serve_locally(scale, seed):
+    os.environ.setdefault("STORAGE_BACKEND", "memory")
+    os.environ.setdefault("JOB_WORKERS", "0")
+    from werkzeug.serving import make_server
+
+    import main
+
+    datagen.generate(main.datastore_client, scale["stores"], scale["items"], scale["prices"], seed=seed)
+    main.store_locator.invalidate()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def run(base_url, scale, mix, concurrency, duration, seed):
+    recorder = Recorder()
+    flows = list(mix)
+    weights = [mix[name] for name in flows]
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        session = Session(base_url, recorder, rng, scale)
+        while time.monotonic() < deadline:
+            getattr(session, rng.choices(flows, weights)[0])()
+
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(concurrency)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.monotonic() - start
+
+
+def summarize(recorder, elapsed):
+    routes = []
+    for route, samples in recorder.samples.items():
+        ordered = sorted(samples)
+        statuses = recorder.statuses[route]
+        routes.append({
+            "route": route,
+            "requests": len(samples),
+            "throughput_rps": len(samples) / elapsed,
+            "errors": sum(count for status, count in statuses.items() if status == "error" or status >= 500),
+            "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+            "p50_ms": percentile(ordered, 0.50),
+            "p95_ms": percentile(ordered, 0.95),
+            "p99_ms": percentile(ordered, 0.99),
+            "max_ms": ordered[-1],
+        })
+    routes.sort(key=lambda route: route["p99_ms"], reverse=True)
+    return routes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="base URL of a running app; default serves one in-process")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"flow weights, default {DEFAULT_MIX}")
+    parser.add_argument("--scale", default="1000:10000:100000", help="stores:items:prices the data was seeded with")
+    parser.add_argument("--seed", type=int, default=467)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    stores, items, prices = (int(value) for value in args.scale.split(":"))
+    scale = {"stores": stores, "items": items, "prices": prices}
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server, base_url = serve_locally(scale, args.seed)
+
+    recorder, elapsed = run(base_url, scale, args.mix, args.concurrency, args.duration, args.seed)
+    if server is not None:
+        server.shutdown()
+    routes = summarize(recorder, elapsed)
+
+    total = sum(route["requests"] for route in routes)
+    print(f"{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s) at concurrency {args.concurrency}")
+    print(f"{'route':<52} {'reqs':>7} {'req/s':>7} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route in routes:
+        print(f"{route['route']:<52} {route['requests']:>7} {route['throughput_rps']:>7.1f} {route['errors']:>6} "
+              f"{route['p50_ms']:>8.1f} {route['p95_ms']:>8.1f} {route['p99_ms']:>8.1f}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({
+                "created": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+                "url": args.url,
+                "scale": scale,
+                "concurrency": args.concurrency,
+                "duration_seconds": elapsed,
+                "mix": args.mix,
+                "requests": total,
+                "throughput_rps": total / elapsed,
+                "routes": routes,
+            }, output, indent=2)
+        print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
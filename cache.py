@@ -0,0 +1,78 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+# In-process read-through cache for entities fetched by key. Entries are keyed
+# by (kind, id), evicted least-recently-used once max_entries is reached and
+# expire after the TTL configured for their kind. Callers get a copy so that
+# mutating a returned entity never changes the cached one.
+class EntityCache:
+    def __init__(self, max_entries=10000, ttls=None, default_ttl=60):
+        self.max_entries = max_entries
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, kind, entity_id):
+        key = (kind, entity_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, entity = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(entity)
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def set(self, kind, entity_id, entity):
+        key = (kind, entity_id)
+        expires_at = time.monotonic() + self.ttls.get(kind, self.default_ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, copy.deepcopy(entity))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, kind, entity_id, load):
+        entity = self.get(kind, entity_id)
+        if entity is None:
+            entity = load()
+            if entity is not None:
+                self.set(kind, entity_id, entity)
+        return entity
+
+    def invalidate(self, kind, entity_id):
+        with self._lock:
+            if self._entries.pop((kind, entity_id), None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,124 @@
+import datetime
+import random
+
+from google.api_core import exceptions
+from google.cloud import datastore
+
+import batching
+import leaderboard
+
+# Reputation changes go to one of SHARD_COUNT ReputationShard entities per
+# user, keyed "<user_id>:<shard>" and picked at random, so a burst of points
+# for one user spreads over many entity groups instead of queueing on the
+# User. A shard holds points not yet folded into User.reputation; a fold adds
+# them to the User and deletes the shards, at most once per FOLD_INTERVAL per
+# user, and reads add whatever is still pending.
+KIND = "ReputationShard"
+SHARD_COUNT = 20
+FOLD_INTERVAL = 60
+# Attempts per transaction; each retry picks fresh shards.
+MAX_ATTEMPTS = 5
+# Users per transaction in add_many; each one reads and writes a shard.
+BATCH_USERS = 200
+
+
+def shard_key(client, user_id, shard):
+    return client.key(KIND, f"{user_id}:{shard}")
+
+
+def shard_keys(client, user_id):
+    return [shard_key(client, user_id, shard) for shard in range(SHARD_COUNT)]
+
+
+def _now():
+    return datetime.datetime.now(tz=datetime.timezone.utc)
+
+
+# Adds points to each user's reputation; `deltas` maps user ids to points.
+# Callers check the users exist.
+def add_many(client, deltas):
+    deltas = {user_id: points for user_id, points in deltas.items() if points}
+    for chunk in batching.chunked(list(deltas), BATCH_USERS):
+        for attempt in range(MAX_ATTEMPTS):
+            keys = [shard_key(client, user_id, random.randrange(SHARD_COUNT)) for user_id in chunk]
+            try:
+                with client.transaction():
+                    shards = {shard.key.name: shard for shard in client.get_multi(keys)}
+                    updated = []
+                    for key, user_id in zip(keys, chunk):
+                        shard = shards.get(key.name)
+                        if shard is None:
+                            shard = datastore.Entity(key=key)
+                            shard.update({"user_id": user_id, "points": 0})
+                        shard["points"] += deltas[user_id]
+                        updated.append(shard)
+                    client.put_multi(updated)
+                break
+            except exceptions.Conflict:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+
+
+def fold(client, user_id):
+    # Moves the user's pending points onto User.reputation. Returns the
+    # updated User, or None if it doesn't exist.
+    with client.transaction():
+        user = client.get(client.key("User", user_id))
+        if user is None:
+            return None
+        shards = client.get_multi(shard_keys(client, user_id))
+        user["reputation"] = leaderboard.score(user.get("reputation")) + sum(shard["points"] for shard in shards)
+        user["reputation_folded_at"] = _now()
+        client.put(user)
+        if shards:
+            client.delete_multi([shard.key for shard in shards])
+    return user
+
+
+def _fold_due(user):
+    folded_at = user.get("reputation_folded_at")
+    return folded_at is None or (_now() - folded_at).total_seconds() >= FOLD_INTERVAL
+
+
+# Reads users with their pending points included in "reputation", folding
+# those that are due. A fold that loses a race is left for the next read;
+# the points stay in the shards meanwhile.
+def load_users(client, user_ids):
+    user_ids = batching.unique(user_ids)
+    keys = [client.key("User", user_id) for user_id in user_ids]
+    for user_id in user_ids:
+        keys.extend(shard_keys(client, user_id))
+    users = {}
+    pending = {}
+    for entity in batching.get_multi(client, keys):
+        if entity.key.kind == KIND:
+            pending[entity["user_id"]] = pending.get(entity["user_id"], 0) + entity["points"]
+        else:
+            users[entity.key.id] = entity
+    for user_id, points in pending.items():
+        user = users.get(user_id)
+        if user is None:
+            continue
+        if _fold_due(user):
+            try:
+                folded = fold(client, user_id)
+            except exceptions.Conflict:
+                folded = None
+            if folded is not None:
+                users[user_id] = folded
+                continue
+        user["reputation"] = leaderboard.score(user.get("reputation")) + points
+    return users
+
+
+def pending_totals(client):
+    # Unfolded points of every user, for full leaderboard loads. Shards are
+    # deleted when folded, so this reads only recent activity.
+    totals = {}
+    for shard in client.query(kind=KIND).fetch():
+        totals[shard["user_id"]] = totals.get(shard["user_id"], 0) + shard["points"]
+    return totals
+
+
+def clear(client, user_id):
+    client.delete_multi(shard_keys(client, user_id))
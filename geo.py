@@ -0,0 +1,218 @@
+import math
+import threading
+import time
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = 111.195
+# 0.1 degrees is roughly 11 km of latitude, so the default 25 km search
+# touches a handful of cells instead of every store.
+CELL_SIZE_DEG = 0.1
+# Beyond this many cells a radius query is cheaper as a plain scan.
+MAX_SCAN_CELLS = 4096
+
+
+def haversine_km(lat, lon, lats, lons):
+    lat1 = np.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - np.radians(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def within_radius(lat, lon, lats, lons, radius_km):
+    distances = haversine_km(lat, lon, lats, lons)
+    mask = distances <= radius_km
+    matches = np.flatnonzero(mask)
+    order = matches[np.argsort(distances[matches], kind="stable")]
+    return distances, mask, order
+
+
+# Contiguous float64 coordinate arrays, sorted by grid cell so that each cell
+# is a slice of the arrays.
+class StoreCoordinates:
+    def __init__(self, ids, lats, lons, cell_slices):
+        self.ids = ids
+        self.lats = lats
+        self.lons = lons
+        self.cell_slices = cell_slices
+
+    def __len__(self):
+        return len(self.ids)
+
+    def indices(self, cells):
+        ranges = [self.cell_slices[cell] for cell in cells if cell in self.cell_slices]
+        if not ranges:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate([np.arange(start, stop) for start, stop in ranges])
+
+
+class GridIndex:
+    def __init__(self, cell_size=CELL_SIZE_DEG):
+        self.cell_size = cell_size
+        self.lon_cells = int(round(360 / cell_size))
+        self.max_lat_cell = int(math.floor(90 / cell_size))
+        self._positions = {}
+        self._coordinates = None
+
+    def __len__(self):
+        return len(self._positions)
+
+    def cell_for(self, lat, lon):
+        lat_cell = min(int(math.floor(lat / self.cell_size)), self.max_lat_cell)
+        lon_cell = int(math.floor(lon / self.cell_size)) % self.lon_cells
+        return lat_cell, lon_cell
+
+    def add(self, store_id, lat, lon):
+        self._positions[store_id] = (float(lat), float(lon))
+        self._coordinates = None
+
+    def remove(self, store_id):
+        if self._positions.pop(store_id, None) is not None:
+            self._coordinates = None
+
+    def clear(self):
+        self._positions.clear()
+        self._coordinates = None
+
+    def coordinates(self):
+        # Rebuilt from memory after a store write; no Datastore reads involved.
+        if self._coordinates is None:
+            entries = sorted(
+                (self.cell_for(lat, lon), store_id, lat, lon)
+                for store_id, (lat, lon) in self._positions.items()
+            )
+            cell_slices = {}
+            for position, (cell, _, _, _) in enumerate(entries):
+                start, _ = cell_slices.get(cell, (position, position))
+                cell_slices[cell] = (start, position + 1)
+            self._coordinates = StoreCoordinates(
+                np.array([entry[1] for entry in entries]),
+                np.ascontiguousarray([entry[2] for entry in entries], dtype=np.float64),
+                np.ascontiguousarray([entry[3] for entry in entries], dtype=np.float64),
+                cell_slices,
+            )
+        return self._coordinates
+
+    def _lon_span(self, lat, km):
+        lat_cos = max(math.cos(math.radians(min(abs(lat), 89.9))), 1e-6)
+        return km / (KM_PER_DEGREE * lat_cos)
+
+    def _box_cells(self, lat, lon, radius_km):
+        dlat = radius_km / KM_PER_DEGREE
+        dlon = self._lon_span(max(abs(lat - dlat), abs(lat + dlat)), radius_km)
+        lat_lo, lon_lo = self.cell_for(max(lat - dlat, -90), lon - dlon)
+        lat_hi, _ = self.cell_for(min(lat + dlat, 90), lon + dlon)
+        lon_count = int(math.floor((lon + dlon) / self.cell_size)) - int(math.floor((lon - dlon) / self.cell_size)) + 1
+        lon_count = min(lon_count, self.lon_cells)
+        if (lat_hi - lat_lo + 1) * lon_count > MAX_SCAN_CELLS:
+            return None
+        return [
+            (lat_cell, lon_cell % self.lon_cells)
+            for lat_cell in range(lat_lo, lat_hi + 1)
+            for lon_cell in range(lon_lo, lon_lo + lon_count)
+        ]
+
+    def within(self, lat, lon, radius_km):
+        coordinates = self.coordinates()
+        cells = self._box_cells(lat, lon, radius_km)
+        candidates = np.arange(len(coordinates)) if cells is None else coordinates.indices(cells)
+        distances, _, order = within_radius(lat, lon, coordinates.lats[candidates], coordinates.lons[candidates], radius_km)
+        return coordinates.ids[candidates[order]].tolist(), distances[order].tolist()
+
+    def _ring_cells(self, center, ring):
+        lat_center, lon_center = center
+        lat_range = range(max(lat_center - ring, -self.max_lat_cell), min(lat_center + ring, self.max_lat_cell) + 1)
+        cells = set()
+        for lat_cell in lat_range:
+            if abs(lat_cell - lat_center) == ring:
+                lon_cells = range(lon_center - ring, lon_center + ring + 1)
+            else:
+                lon_cells = (lon_center - ring, lon_center + ring)
+            cells.update((lat_cell, lon_cell % self.lon_cells) for lon_cell in lon_cells)
+        return cells
+
+    def nearest(self, lat, lon, k, max_km=None):
+        coordinates = self.coordinates()
+        center = self.cell_for(lat, lon)
+        searched = set()
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 > MAX_SCAN_CELLS:
+                candidates = np.arange(len(coordinates))
+                break
+            searched |= self._ring_cells(center, ring)
+            candidates = coordinates.indices(searched)
+            if len(candidates) == len(coordinates):
+                break
+            # Anything outside the rings searched so far is at least this far away.
+            covered_deg = ring * self.cell_size
+            covered_km = covered_deg * KM_PER_DEGREE * math.cos(math.radians(min(abs(lat) + covered_deg, 90)))
+            if max_km is not None and covered_km >= max_km:
+                break
+            if len(candidates) >= k:
+                distances = haversine_km(lat, lon, coordinates.lats[candidates], coordinates.lons[candidates])
+                if np.partition(distances, k - 1)[k - 1] <= covered_km:
+                    break
+            ring += 1
+
+        distances = haversine_km(lat, lon, coordinates.lats[candidates], coordinates.lons[candidates])
+        if max_km is not None:
+            keep = distances <= max_km
+            candidates, distances = candidates[keep], distances[keep]
+        if len(candidates) > k:
+            top = np.argpartition(distances, k - 1)[:k]
+            candidates, distances = candidates[top], distances[top]
+        order = np.argsort(distances, kind="stable")
+        return coordinates.ids[candidates[order]].tolist(), distances[order].tolist()
+
+
+# Grid index over store coordinates, kept current by the store write helpers.
+# Writes made by other instances are picked up by a full reload every `ttl`
+# seconds.
+class StoreLocator:
+    def __init__(self, load_stores, ttl=300, cell_size=CELL_SIZE_DEG):
+        self._load_stores = load_stores
+        self._ttl = ttl
+        self._index = GridIndex(cell_size)
+        self._loaded_at = None
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self._ttl:
+            return
+        index = GridIndex(self._index.cell_size)
+        for store_id, lat, lon in self._load_stores():
+            index.add(store_id, lat, lon)
+        self._index = index
+        self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def upsert(self, store_id, lat, lon):
+        with self._lock:
+            if self._loaded_at is not None:
+                self._index.add(store_id, lat, lon)
+
+    def remove(self, store_id):
+        with self._lock:
+            self._index.remove(store_id)
+
+    def coordinates(self):
+        with self._lock:
+            self._ensure_loaded()
+            return self._index.coordinates()
+
+    def within(self, lat, lon, radius_km):
+        with self._lock:
+            self._ensure_loaded()
+            return self._index.within(lat, lon, radius_km)
+
+    def nearest(self, lat, lon, k, max_km=None):
+        with self._lock:
+            self._ensure_loaded()
+            return self._index.nearest(lat, lon, k, max_km)
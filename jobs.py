@@ -0,0 +1,171 @@
+import datetime
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from google.cloud import datastore
+
+LEASE_SECONDS = 60
+POLL_INTERVAL = 2
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+# A handler processes one chunk of a job: it receives the job's params and the
+# cursor saved after the previous chunk, and returns (next_cursor, processed).
+# A next_cursor of None marks the job done. Chunks must be safe to re-run,
+# because a chunk interrupted by a crash is retried from the last saved cursor.
+def handler(job_type):
+    def register(fn):
+        _handlers[job_type] = fn
+        return fn
+    return register
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def _now():
+    return datetime.datetime.now(tz=datetime.timezone.utc)
+
+
+# Job queue persisted as Job entities, worked by threads in this process or
+# by worker.py. Workers lease a job while running it, so a job whose worker
+# died is picked up again once its lease expires.
+class JobRunner:
+    def __init__(self, client, lease_seconds=LEASE_SECONDS, poll_interval=POLL_INTERVAL):
+        self.client = client
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def enqueue(self, job_type, params):
+        if job_type not in _handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        now = _now()
+        job = datastore.Entity(key=self.client.key("Job"), exclude_from_indexes=("params", "cursor", "error"))
+        job.update({
+            "job_type": job_type,
+            "params": json.dumps(params),
+            "status": "queued",
+            "cursor": None,
+            "processed": 0,
+            "error": None,
+            "lease_owner": None,
+            "lease_expires": None,
+            "created": now,
+            "updated": now
+        })
+        self.client.put(job)
+        self._wake.set()
+        return job.key.id
+
+    def get(self, job_id):
+        return self.client.get(self.client.key("Job", job_id))
+
+    def _claimable(self):
+        queued = self.client.query(kind="Job")
+        queued.add_filter("status", "=", "queued")
+        expired = self.client.query(kind="Job")
+        expired.add_filter("status", "=", "running")
+        expired.add_filter("lease_expires", "<", _now())
+        return list(queued.fetch(limit=10)) + list(expired.fetch(limit=10))
+
+    def _is_claimable(self, job):
+        if job is None:
+            return False
+        if job["status"] == "queued":
+            return True
+        return job["status"] == "running" and job["lease_expires"] is not None and job["lease_expires"] < _now()
+
+    def claim(self):
+        for candidate in self._claimable():
+            with self.client.transaction():
+                job = self.client.get(candidate.key)
+                if not self._is_claimable(job):
+                    continue
+                job["status"] = "running"
+                job["lease_owner"] = self.worker_id
+                job["lease_expires"] = _now() + datetime.timedelta(seconds=self.lease_seconds)
+                job["updated"] = _now()
+                self.client.put(job)
+            return job
+        return None
+
+    def _save_progress(self, job, updates):
+        with self.client.transaction():
+            current = self.client.get(job.key)
+            if current is None or current["lease_owner"] != self.worker_id:
+                raise LeaseLost(job.key.id)
+            current.update(updates)
+            current["updated"] = _now()
+            if current["status"] == "running":
+                current["lease_expires"] = _now() + datetime.timedelta(seconds=self.lease_seconds)
+            self.client.put(current)
+        return current
+
+    def run_job(self, job):
+        run_chunk = _handlers.get(job["job_type"])
+        if run_chunk is None:
+            self._save_progress(job, {"status": "failed", "error": f"Unknown job type: {job['job_type']}"})
+            return
+        params = json.loads(job["params"])
+        try:
+            while True:
+                cursor, processed = run_chunk(self.client, params, job["cursor"])
+                updates = {"cursor": cursor, "processed": job["processed"] + processed}
+                if cursor is None:
+                    updates["status"] = "done"
+                    updates["lease_owner"] = None
+                job = self._save_progress(job, updates)
+                if cursor is None:
+                    return
+        except LeaseLost:
+            logger.warning("Lost lease on job %s; another worker took it over", job.key.id)
+        except Exception as error:
+            logger.exception("Job %s failed", job.key.id)
+            self._save_progress(job, {"status": "failed", "error": str(error), "lease_owner": None})
+
+    def run_once(self):
+        job = self.claim()
+        if job is None:
+            return False
+        self.run_job(job)
+        return True
+
+    def work(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                logger.exception("Job worker error")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self, workers=1):
+        with self._lock:
+            if self._threads or workers <= 0:
+                return
+            for index in range(workers):
+                thread = threading.Thread(target=self.work, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def join(self):
+        for thread in list(self._threads):
+            thread.join()
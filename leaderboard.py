@@ -0,0 +1,189 @@
+import random
+import threading
+import time
+
+MAX_LEVEL = 32
+LEVEL_PROBABILITY = 0.25
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        # width[i] is how many positions next[i] skips ahead.
+        self.width = [0] * level
+
+
+# Skip list whose links also record how many nodes they skip, so rank lookups
+# and positional access are O(log n) like in an order-statistic tree.
+class IndexableSkipList:
+    def __init__(self, seed=None):
+        self._head = _Node(None, MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+        self._random = random.Random(seed)
+
+    def __len__(self):
+        return self._size
+
+    def _random_level(self):
+        level = 1
+        while level < MAX_LEVEL and self._random.random() < LEVEL_PROBABILITY:
+            level += 1
+        return level
+
+    def insert(self, key):
+        update = [self._head] * MAX_LEVEL
+        rank = [0] * MAX_LEVEL
+        node = self._head
+        for i in reversed(range(self._level)):
+            rank[i] = rank[i + 1] if i + 1 < self._level else 0
+            while node.next[i] is not None and node.next[i].key < key:
+                rank[i] += node.width[i]
+                node = node.next[i]
+            update[i] = node
+
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                rank[i] = 0
+                update[i] = self._head
+                self._head.width[i] = self._size
+            self._level = level
+
+        new_node = _Node(key, level)
+        for i in range(level):
+            new_node.next[i] = update[i].next[i]
+            update[i].next[i] = new_node
+            new_node.width[i] = update[i].width[i] - (rank[0] - rank[i])
+            update[i].width[i] = rank[0] - rank[i] + 1
+        for i in range(level, self._level):
+            update[i].width[i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        update = [self._head] * MAX_LEVEL
+        node = self._head
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+
+        target = node.next[0]
+        if target is None or target.key != key:
+            return False
+        for i in range(self._level):
+            if update[i].next[i] is target:
+                update[i].width[i] += target.width[i] - 1
+                update[i].next[i] = target.next[i]
+            else:
+                update[i].width[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+        return True
+
+    def rank(self, key):
+        position = 0
+        node = self._head
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.next[i].key <= key:
+                position += node.width[i]
+                node = node.next[i]
+        if node is not self._head and node.key == key:
+            return position - 1
+        return None
+
+    def slice(self, start, count):
+        if start < 0 or start >= self._size or count <= 0:
+            return []
+        traversed = 0
+        node = self._head
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and traversed + node.width[i] <= start + 1:
+                traversed += node.width[i]
+                node = node.next[i]
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+# Users ranked by reputation (highest first, ties broken by user id). Kept
+# current by the reputation and user write helpers; a full reload every `ttl`
+# seconds picks up writes made by other instances.
+def score(reputation):
+    # Users saved with a missing or non-numeric reputation rank as 0 instead
+    # of breaking the ordering for everyone.
+    if isinstance(reputation, (int, float)) and not isinstance(reputation, bool):
+        return reputation
+    return 0
+
+
+class Leaderboard:
+    def __init__(self, load_users, ttl=900):
+        self._load_users = load_users
+        self._ttl = ttl
+        self._ranking = IndexableSkipList()
+        self._users = {}
+        self._loaded_at = None
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self._ttl:
+            return
+        ranking = IndexableSkipList()
+        users = {}
+        for user_id, username, reputation in self._load_users():
+            reputation = score(reputation)
+            users[user_id] = (username, reputation)
+            ranking.insert((-reputation, user_id))
+        self._ranking = ranking
+        self._users = users
+        self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def update(self, user_id, username, reputation):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            reputation = score(reputation)
+            previous = self._users.get(user_id)
+            if previous is not None:
+                self._ranking.remove((-previous[1], user_id))
+            self._users[user_id] = (username, reputation)
+            self._ranking.insert((-reputation, user_id))
+
+    def remove(self, user_id):
+        with self._lock:
+            previous = self._users.pop(user_id, None)
+            if previous is not None:
+                self._ranking.remove((-previous[1], user_id))
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._ranking)
+
+    def page(self, offset, limit):
+        with self._lock:
+            self._ensure_loaded()
+            rankings = []
+            for position, (_, user_id) in enumerate(self._ranking.slice(offset, limit), start=offset + 1):
+                username, reputation = self._users[user_id]
+                rankings.append({"rank": position, "user_id": user_id, "username": username, "reputation": reputation})
+            return rankings
+
+    def rank_of(self, user_id):
+        with self._lock:
+            self._ensure_loaded()
+            user = self._users.get(user_id)
+            if user is None:
+                return None
+            return self._ranking.rank((-user[1], user_id)) + 1
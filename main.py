@@ -1,16 +1,44 @@
 import datetime
 import hashlib
-import math
 import os
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, g, has_request_context, send_file
 from google.cloud import datastore
-
-datastore_client = datastore.Client()
+import batching
+import cache
+import counters
+import geo
+import jobs
+import leaderboard
+import metrics
+import price_history
+import pricing
+import reservations
+import profiling
+import search
+import storage
+import tagging
+import unit_of_work
+import write_behind
+
+datastore_client = metrics.InstrumentedClient(storage.create_client())
 app = Flask(__name__, static_url_path='/static')
+metrics.install(app)
+profiling.install(app)
 app.secret_key = os.urandom(24)
+entity_cache = cache.EntityCache(max_entries=10000, ttls={"User": 30, "Item": 300, "Store": 300})
+job_runner = jobs.JobRunner(datastore_client)
+# Activity logs are written behind the request in batches; see write_behind.
+activity_log_writer = write_behind.WriteBehindBuffer(
+    datastore_client,
+    max_entries=int(os.environ.get("ACTIVITY_LOG_BUFFER", "5000")),
+    flush_interval=float(os.environ.get("ACTIVITY_LOG_FLUSH_SECONDS", "1")),
+    overflow=os.environ.get("ACTIVITY_LOG_OVERFLOW", "block"),
+)
 
 # DATASTORE FUNCTIONS
 def store_user(username, email, password_hash, reputation=0, role="User"):
+    if not is_points(reputation):
+        raise ValueError(f"Invalid reputation: {reputation!r}")
     entity = datastore.Entity(key=datastore_client.key("User"))
     entity.update({
         "username": username,
@@ -20,7 +48,8 @@ def store_user(username, email, password_hash, reputation=0, role="User"):
         "role": role,
         "timestamp": datetime.datetime.now(tz=datetime.timezone.utc)
     })
-    datastore_client.put(entity)
+    reservations.insert(datastore_client, entity)
+    user_leaderboard.update(entity.key.id, username, reputation)
     return entity.key.id
 
 
@@ -32,23 +61,32 @@ def store_item(name, tags, brand):
         "brand": brand,
         "timestamp": datetime.datetime.now(tz=datetime.timezone.utc)
     })
-    datastore_client.put(entity)
-    return entity.key.id
+    item_id = reservations.insert(datastore_client, entity)
+    tagging.sync(datastore_client, datastore_client, item_id, [], tags)
+    index_item(entity)
+    return item_id
 
 
-def store_store_info(name, location):
+def store_store_info(name, location, latitude=None, longitude=None):
     entity = datastore.Entity(key=datastore_client.key("Store"))
     entity.update({
         "name": name,
         "location": location,
         "timestamp": datetime.datetime.now(tz=datetime.timezone.utc)
     })
-    datastore_client.put(entity)
+    if latitude is not None and longitude is not None:
+        entity.update({"latitude": latitude, "longitude": longitude})
+    reservations.insert(datastore_client, entity)
+    if latitude is not None and longitude is not None:
+        store_locator.upsert(entity.key.id, latitude, longitude)
     return entity.key.id
 
 
 
 def store_price(item_id, store_id, price, user_id, sale_status):
+    price = pricing.parse_price(price)
+    if price is None:
+        raise ValueError("Invalid price")
     entity = datastore.Entity(key=datastore_client.key("Price"))
     entity.update({
         "item_id": item_id,
@@ -59,9 +97,54 @@ def store_price(item_id, store_id, price, user_id, sale_status):
         "timestamp": datetime.datetime.now(tz=datetime.timezone.utc)
     })
     datastore_client.put(entity)
+    store_price_summary(item_id, store_id, price, sale_status, entity["timestamp"], get_user_reputation(user_id))
     return entity.key.id
 
 
+def store_price_summary(item_id, store_id, price, sale_status, timestamp, reputation=None):
+    summaries = store_price_summaries([(item_id, store_id, price, sale_status, timestamp, reputation)])
+    return summaries[0] if summaries else None
+
+
+def store_price_summaries(observations):
+    # Prices are normalised here, outside the transaction; one that isn't a
+    # number is left out of the summary rather than failing the whole batch.
+    observations_by_name = {}
+    for observation in observations:
+        price = pricing.parse_price(observation[2])
+        if price is None:
+            continue
+        observation = observation[:2] + (price,) + tuple(observation[3:])
+        name = pricing.summary_key_name(observation[0], observation[1])
+        observations_by_name.setdefault(name, []).append(observation)
+
+    # Each (item, store) pair writes its summary and its history, so a
+    # transaction takes half as many pairs as it has mutations.
+    summaries = []
+    for names in batching.chunked(list(observations_by_name), batching.PUT_MULTI_LIMIT // 2):
+        keys = [datastore_client.key("PriceSummary", name) for name in names]
+        history_keys = [datastore_client.key("PriceHistory", name) for name in names]
+        with datastore_client.transaction():
+            existing = {(entity.key.kind, entity.key.name): entity for entity in datastore_client.get_multi(keys + history_keys)}
+            updated = []
+            histories = []
+            for key, history_key in zip(keys, history_keys):
+                summary = existing.get(("PriceSummary", key.name))
+                if summary is None:
+                    summary = datastore.Entity(key=key, exclude_from_indexes=pricing.SUMMARY_UNINDEXED)
+                history = existing.get(("PriceHistory", key.name))
+                if history is None:
+                    history = datastore.Entity(key=history_key, exclude_from_indexes=("series",))
+                for observation in observations_by_name[key.name]:
+                    pricing.apply_price_observation(summary, *observation)
+                    price_history.apply_price_observation(history, *observation[:5])
+                updated.append(summary)
+                histories.append(history)
+            datastore_client.put_multi(updated + histories)
+        summaries.extend(updated)
+    return summaries
+
+
 def store_shoppinglist(user_id, items):
     entity = datastore.Entity(key=datastore_client.key("ShoppingList"))
     entity.update({
@@ -81,8 +164,7 @@ def store_activitylog(user_id, activity_type, details):
         "details": details,
         "timestamp": datetime.datetime.now(tz=datetime.timezone.utc)
     })
-    datastore_client.put(entity)
-    return entity.key.id
+    return activity_log_writer.put(entity)
 
 
 def store_tag(name):
@@ -91,8 +173,7 @@ def store_tag(name):
         "name": name,
         "timestamp": datetime.datetime.now(tz=datetime.timezone.utc)
     })
-    datastore_client.put(entity)
-    return entity.key.id
+    return reservations.insert(datastore_client, entity)
 
 
 def store_comment(user_id, item_id, comment, rating):
@@ -108,34 +189,127 @@ def store_comment(user_id, item_id, comment, rating):
     return entity.key.id
 
 
+def get_entities_by_ids(kind, entity_ids):
+    found = {}
+    missing = []
+    for entity_id in batching.unique(entity_ids):
+        entity = entity_cache.get(kind, entity_id)
+        if entity is None:
+            missing.append(entity_id)
+        else:
+            found[entity_id] = entity
+    for chunk in batching.chunked(missing, batching.GET_MULTI_LIMIT):
+        for entity in datastore_client.get_multi([datastore_client.key(kind, entity_id) for entity_id in chunk]):
+            entity_cache.set(kind, entity.key.id, entity)
+            found[entity.key.id] = entity
+    return found
+
+
+def fetch_page(query, limit, cursor=None):
+    iterator = query.fetch(limit=limit, start_cursor=cursor)
+    entities = list(next(iterator.pages))
+    next_cursor = iterator.next_page_token
+    if isinstance(next_cursor, bytes):
+        next_cursor = next_cursor.decode("ascii")
+    return entities, next_cursor
+
+
+def current_writer():
+    # Inside a request, writes are queued on a unit of work and committed
+    # together when the request finishes; elsewhere they go straight out.
+    if not has_request_context():
+        return datastore_client
+    if "unit_of_work" not in g:
+        g.unit_of_work = unit_of_work.UnitOfWork(datastore_client)
+    return g.unit_of_work
+
+
+def after_commit(callback):
+    writer = current_writer()
+    if writer is datastore_client:
+        callback()
+    else:
+        writer.after_flush(callback)
+
+
+def reserve_id(entity):
+    # Callers need the id before the entity is written, e.g. to key its tag
+    # memberships, and queued entities only get one at flush time.
+    if entity.key.is_partial:
+        entity.key = datastore_client.allocate_ids(entity.key, 1)[0]
+    return entity.key.id
+
+
+@app.after_request
+def flush_unit_of_work(response):
+    work = g.pop("unit_of_work", None)
+    if work is not None:
+        if response.status_code < 500:
+            work.flush()
+        else:
+            work.discard()
+    return response
+
+
+def page_args(default_limit=100, max_limit=500):
+    limit = request.args.get("limit", default_limit, type=int)
+    return max(1, min(limit, max_limit)), request.args.get("cursor")
+
+
 # USER FUNCTIONS
 def get_user_by_id(user_id):
-    key = datastore_client.key("User", user_id)
-    user = datastore_client.get(key)
+    user = entity_cache.get_or_load("User", user_id, lambda: counters.load_users(datastore_client, [user_id]).get(user_id))
     if user:
         user["id"] = user.key.id
         return user
     return None
 
 
+def user_key_id(user_id):
+    # Price reports carry the user id as sent, which may be a string.
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_user_reputation(user_id):
+    user_id = user_key_id(user_id)
+    if user_id is None:
+        return None
+    user = get_user_by_id(user_id)
+    return user.get("reputation") if user else None
+
+
+def get_by_unique_value(kind, value, load):
+    entity_id = reservations.lookup_id(datastore_client, kind, value)
+    if entity_id is None:
+        return None
+    entity = load(entity_id)
+    if entity is None or entity.get(reservations.UNIQUE_PROPERTIES[kind][1]) != value:
+        return None
+    entity["id"] = entity.key.id
+    return entity
+
+
 def get_user_by_email(email):
-    query = datastore_client.query(kind="User")
-    query.add_filter("email", "=", email)
-    result = list(query.fetch())
-    if result:
-        user = result[0]
-        user["id"] = user.key.id
-        return user
-    return None
+    return get_by_unique_value("User", email, get_user_by_id)
 
 
 def update_user_info(user_id, updated_data):
     key = datastore_client.key("User", user_id)
     user = datastore_client.get(key)
     if user:
+        previous_email = user.get("email")
         for k, value in updated_data.items():
             user[k] = value
-        datastore_client.put(user)
+        reservations.update(datastore_client, user, previous_email)
+        if "reputation" in updated_data:
+            # A reputation set outright replaces any points still pending.
+            counters.clear(datastore_client, user_id)
+        entity_cache.invalidate("User", user_id)
+        user = get_user_by_id(user_id) or user
+        user_leaderboard.update(user.key.id, user.get("username"), user.get("reputation", 0))
         return user
     return None
 
@@ -144,7 +318,10 @@ def delete_user(user_id):
     key = datastore_client.key("User", user_id)
     user = datastore_client.get(key)
     if user:
-        datastore_client.delete(user.key)
+        reservations.delete(datastore_client, user)
+        counters.clear(datastore_client, user_id)
+        entity_cache.invalidate("User", user_id)
+        user_leaderboard.remove(user.key.id)
         return True
     return False
 
@@ -155,47 +332,82 @@ def hash_password(password):
 
 # REPUTATION & RANKING FUNCTIONS
 def update_user_reputation(user_id, points):
-    user = get_user_by_id(user_id)
-    if user:
-        user["reputation"] += points
-        datastore_client.put(user)
-        return user
-    return None
+    return update_user_reputations({user_id: points}).get(user_id)
+
 
+# Applies {user_id: points} and returns the updated users; unknown users are
+# left out. The points are committed to reputation shards right away rather
+# than through the request's unit of work, so concurrent updates for one user
+# neither contend on the User entity nor overwrite each other.
+def update_user_reputations(deltas):
+    updated = counters.load_users(datastore_client, list(deltas))
+    counters.add_many(datastore_client, {user_id: points for user_id, points in deltas.items() if user_id in updated})
+    for user_id, user in updated.items():
+        user["reputation"] = leaderboard.score(user.get("reputation")) + deltas[user_id]
+        entity_cache.set("User", user_id, user)
+        user_leaderboard.update(user_id, user.get("username"), user.get("reputation", 0))
+    return updated
 
-def get_user_rankings():
+
+def load_user_reputations():
+    pending = counters.pending_totals(datastore_client)
     query = datastore_client.query(kind="User")
-    query.order = ["-reputation"]
-    result = list(query.fetch())
-    rankings = [{"username": user["username"], "reputation": user["reputation"]} for user in result]
-    return rankings
+    for user in query.fetch():
+        yield user.key.id, user.get("username"), leaderboard.score(user.get("reputation")) + pending.get(user.key.id, 0)
+
+
+user_leaderboard = leaderboard.Leaderboard(load_user_reputations)
+
+
+def get_user_rankings(limit=100, offset=0):
+    return user_leaderboard.page(offset, limit)
 
 # ITEM FUNCTIONS
 def get_item_by_id(item_id):
     key = datastore_client.key("Item", int(item_id))
-    item = datastore_client.get(key)
+    item = entity_cache.get_or_load("Item", int(item_id), lambda: datastore_client.get(key))
     if item:
         return item
     return None
 
 def get_item_by_name(name):
+    return get_by_unique_value("Item", name, get_item_by_id)
+
+
+# Items tagged through the tag endpoints hold Tag ids; search indexes names.
+def tag_names(tags, names):
+    return [names.get(tag, tag) for tag in tags or []]
+
+
+def load_item_documents():
     query = datastore_client.query(kind="Item")
-    query.add_filter("name", "=", name)
-    result = list(query.fetch())
-    if result:
-        item = result[0]
-        item["id"] = item.key.id
-        return item
-    return None
+    items = list(query.fetch())
+    names = tagging.names(datastore_client, [tag for item in items for tag in item.get("tags") or []])
+    for item in items:
+        yield item.key.id, item.get("name"), item.get("brand"), tag_names(item.get("tags"), names)
+
+
+item_search = search.ItemSearch(load_item_documents, snapshot_path=os.environ.get("SEARCH_SNAPSHOT") or None)
+
+
+def index_item(item):
+    tags = item.get("tags") or []
+    item_search.upsert(item.key.id, item.get("name"), item.get("brand"), tag_names(tags, tagging.names(datastore_client, tags)))
 
 
 def update_item_info(item_id, updated_data):
     key = datastore_client.key("Item", item_id)
     item = datastore_client.get(key)
     if item:
+        previous_name = item.get("name")
+        previous_tags = list(item.get("tags") or [])
         for k, value in updated_data.items():
             item[k] = value
-        datastore_client.put(item)
+        reservations.update(datastore_client, item, previous_name)
+        if "tags" in updated_data:
+            tagging.sync(datastore_client, datastore_client, item_id, previous_tags, item.get("tags"))
+        entity_cache.invalidate("Item", item_id)
+        index_item(item)
         return item
     return None
 
@@ -204,7 +416,10 @@ def delete_item(item_id):
     key = datastore_client.key("Item", item_id)
     item = datastore_client.get(key)
     if item:
-        datastore_client.delete(item.key)
+        reservations.delete(datastore_client, item)
+        tagging.sync(datastore_client, datastore_client, item_id, item.get("tags"), [])
+        entity_cache.invalidate("Item", item_id)
+        item_search.remove(item_id)
         return True
     return False
 
@@ -212,7 +427,7 @@ def delete_item(item_id):
 # STORE FUNCTIONS
 def get_store_by_id(store_id):
     key = datastore_client.key("Store", store_id)
-    store = datastore_client.get(key)
+    store = entity_cache.get_or_load("Store", store_id, lambda: datastore_client.get(key))
     if store:
         store["id"] = store.key.id
         return store
@@ -220,24 +435,21 @@ def get_store_by_id(store_id):
 
 
 def get_store_by_name(name):
-    query = datastore_client.query(kind="Store")
-    query.add_filter("name", "=", name)
-    result = list(query.fetch())
-    if result:
-        store = result[0]
-        store["id"] = store.key.id
-        return store
-    return None
+    return get_by_unique_value("Store", name, get_store_by_id)
 
 
 def update_store_info(store_id, updated_data):
     key = datastore_client.key("Store", store_id)
     store = datastore_client.get(key)
     if store:
+        previous_name = store.get("name")
         for k, value in updated_data.items():
-            if k in ["name", "location"]:
+            if k in ["name", "location", "latitude", "longitude"]:
                 store[k] = value
-        datastore_client.put(store)
+        reservations.update(datastore_client, store, previous_name)
+        entity_cache.invalidate("Store", store_id)
+        if store.get("latitude") is not None and store.get("longitude") is not None:
+            store_locator.upsert(store.key.id, store["latitude"], store["longitude"])
         return store
     return None
 
@@ -247,7 +459,9 @@ def delete_store(store_id):
     key = datastore_client.key("Store", store_id)
     store = datastore_client.get(key)
     if store:
-        datastore_client.delete(store.key)
+        reservations.delete(datastore_client, store)
+        entity_cache.invalidate("Store", store_id)
+        store_locator.remove(store.key.id)
         return True
     return False
 
@@ -293,22 +507,26 @@ def shoppinglist_remove_item(user_id, item):
 
 
 # PRICE FUNCTIONS
-def get_prices_by_item(item_id):
+def get_prices_by_item(item_id, limit=100, cursor=None):
     query = datastore_client.query(kind="Price")
     query.add_filter("item_id", "=", item_id)
-    results = list(query.fetch())
-    return results
+    query.order = ["-timestamp"]
+    return fetch_page(query, limit, cursor)
 
 
 def get_price_comparison(shopping_list):
+    prices_by_item = pricing.fetch_prices_for_items(datastore_client, shopping_list, kind="PriceSummary")
+    best = pricing.best_prices(prices_by_item)
     comparison = {}
     for item in shopping_list:
-        prices = get_prices_by_item(item)
-        if prices:
-            best_price = min(prices, key=lambda x: x["price"])
+        best_price = best.get(item)
+        if best_price:
+            # Stores are ranked on the outlier-resistant estimate; the latest
+            # report is returned alongside it.
             comparison[item] = {
                 "store_id": best_price["store_id"],
-                "price": best_price["price"],
+                "price": round(pricing.comparable_price(best_price), 2),
+                "reported_price": best_price["price"],
                 "sale_status": best_price["sale_status"],
                 "timestamp": best_price["timestamp"]
             }
@@ -317,24 +535,65 @@ def get_price_comparison(shopping_list):
     return comparison
 
 
+def rebuild_price_summaries():
+    summaries = {}
+    series = {}
+    reputations = {}
+    query = datastore_client.query(kind="Price")
+    query.order = ["timestamp"]
+    for price in query.fetch():
+        # Rows saved before prices were validated may hold strings like "n/a".
+        value = pricing.parse_price(price.get("price"))
+        if value is None:
+            continue
+        store_id = price.get("store_id")
+        name = pricing.summary_key_name(price["item_id"], store_id)
+        summary = summaries.get(name)
+        if summary is None:
+            key = datastore_client.key("PriceSummary", name)
+            summary = datastore.Entity(key=key, exclude_from_indexes=pricing.SUMMARY_UNINDEXED)
+            summaries[name] = summary
+            series[name] = price_history.PriceSeries()
+        user_id = price.get("user_id")
+        if user_id not in reputations:
+            reputations[user_id] = get_user_reputation(user_id)
+        pricing.apply_price_observation(summary, price["item_id"], store_id, value, price.get("sale_status", False), price["timestamp"],
+                                        reputations[user_id])
+        series[name].add(price["timestamp"], value, price.get("sale_status", False))
+    histories = [
+        price_history.history_entity(datastore_client.key("PriceHistory", name), summary["item_id"], summary["store_id"],
+                                     series[name], summary["observation_count"])
+        for name, summary in summaries.items()
+    ]
+    batching.put_multi(datastore_client, list(summaries.values()) + histories)
+    return len(summaries)
+
+
 # ACTIVITY LOG FUNCTIONS
+# Logs are written behind the request, so a lookup by id checks the buffer
+# first and updates and deletes flush it so a queued write can't undo them;
+# if the flush doesn't finish they raise write_behind.NotFlushed and change
+# nothing.
+# Listings may miss logs from the last ACTIVITY_LOG_FLUSH_SECONDS.
 def get_activitylog_by_id(log_id):
     key = datastore_client.key("ActivityLog", log_id)
-    log = datastore_client.get(key)
+    log = activity_log_writer.get(key) or datastore_client.get(key)
     if log:
         log["id"] = log.key.id
         return log
     return None
 
 
-def get_activitylog_by_user(user_id):
+def get_activitylog_by_user(user_id, limit=100, cursor=None):
     query = datastore_client.query(kind="ActivityLog")
     query.add_filter("user_id", "=", user_id)
-    result = list(query.fetch())
-    return result
+    query.order = ["-timestamp"]
+    return fetch_page(query, limit, cursor)
 
 
 def update_activitylog_info(log_id, updated_data):
+    if not activity_log_writer.flush():
+        raise write_behind.NotFlushed("Activity log writes are still pending")
     key = datastore_client.key("ActivityLog", log_id)
     log = datastore_client.get(key)
     if log:
@@ -346,6 +605,8 @@ def update_activitylog_info(log_id, updated_data):
 
 
 def delete_activitylog(log_id):
+    if not activity_log_writer.flush():
+        raise write_behind.NotFlushed("Activity log writes are still pending")
     key = datastore_client.key("ActivityLog", log_id)
     log = datastore_client.get(key)
     if log:
@@ -365,65 +626,87 @@ def get_tag_by_id(tag_id):
 
 
 def get_tag_by_name(name):
-    query = datastore_client.query(kind="Tag")
-    query.add_filter("name", "=", name)
-    result = list(query.fetch())
-    if result:
-        tag = result[0]
-        tag["id"] = tag.key.id
-        return tag
-    return None
+    return get_by_unique_value("Tag", name, get_tag_by_id)
 
 
 def update_tag_info(tag_id, updated_data):
     key = datastore_client.key("Tag", tag_id)
     tag = datastore_client.get(key)
     if tag:
+        previous_name = tag.get("name")
         for k, value in updated_data.items():
             tag[k] = value
-        datastore_client.put(tag)
+        reservations.update(datastore_client, tag, previous_name)
+        if tag.get("name") != previous_name:
+            reindex_tag_items(tag_id)
         return tag
     return None
 
 
+def reindex_tag_items(tag_id):
+    # Search holds tag names, so items tagged by id pick up a rename.
+    cursor = None
+    while True:
+        item_ids, cursor = tagging.items_with_all(datastore_client, [tag_id], tagging.CHUNK_SIZE, cursor)
+        items = list(get_entities_by_ids("Item", item_ids).values())
+        names = tagging.names(datastore_client, [tag for item in items for tag in item.get("tags") or []])
+        for item in items:
+            item_search.upsert(item.key.id, item.get("name"), item.get("brand"), tag_names(item.get("tags"), names))
+        if cursor is None:
+            return
+
+
 def delete_tag(tag_id):
     key = datastore_client.key("Tag", tag_id)
     tag = datastore_client.get(key)
     if tag:
-        datastore_client.delete(tag.key)
+        reservations.delete(datastore_client, tag)
         return True
     return False
 
 
 def assign_tag_to_item(item_id, tag_id):
-    item = get_item_by_id(item_id)
+    item = datastore_client.get(datastore_client.key("Item", int(item_id)))
     if item:
-        if "tags" not in item:
-            item["tags"] = []
-        item["tags"].append(tag_id)
-        datastore_client.put(item)
+        if tagging.add_tags(datastore_client, datastore_client, item, [tag_id]):
+            datastore_client.put(item)
+        entity_cache.invalidate("Item", item.key.id)
+        index_item(item)
         return item
     return None
 
 
-def assign_tag_to_brand(brand_name, tag_id):
-    query = datastore_client.query(kind="Item")
-    query.add_filter("brand", "=", brand_name)
-    items = list(query.fetch())
-    for item in items:
-        if "tags" not in item:
-            item["tags"] = []
-        item["tags"].append(tag_id)
-        datastore_client.put(item)
-    return items if items else None
+@jobs.handler("assign_tag_to_brand")
+def assign_tag_to_brand_chunk(client, params, cursor):
+    query = client.query(kind="Item")
+    query.add_filter("brand", "=", params["brand_name"])
+    items, next_cursor = fetch_page(query, 200, cursor)
+    # Skipping items that already carry the tag keeps a retried chunk idempotent.
+    resolved = tagging.resolve(client, [params["tag_id"]] + [value for item in items for value in item.get("tags") or []])
+    changed = [item for item in items if tagging.add_tags(client, client, item, [params["tag_id"]], resolved)]
+    batching.put_multi(client, changed)
+    for item in changed:
+        entity_cache.invalidate("Item", item.key.id)
+        index_item(item)
+    return (next_cursor if items else None), len(items)
+
+
+def enqueue_job(job_type, params):
+    return job_runner.enqueue(job_type, params)
+
+
+# The app works the Job queue in JOB_WORKERS threads (default 1) from
+# startup, so jobs whose lease ran out while an instance was down resume
+# without waiting for the next enqueue. JOB_WORKERS=0 leaves them to worker.py.
+job_runner.start(int(os.environ.get("JOB_WORKERS", "1")))
 
 
 # COMMENT FUNCTIONS
-def get_comments_by_item(item_id):
+def get_comments_by_item(item_id, limit=100, cursor=None):
     query = datastore_client.query(kind="Comment")
     query.add_filter("item_id", "=", item_id)
-    result = list(query.fetch())
-    return result
+    query.order = ["-timestamp"]
+    return fetch_page(query, limit, cursor)
 
 
 def update_comment_info(comment_id, updated_data):
@@ -447,56 +730,46 @@ def delete_comment(comment_id):
 
 
 # STORE COMPARISON FUNCTIONS
-def distance_calculation(lat1, lon1, lat2, lon2):
-    radius = 6371
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    equation = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(equation), math.sqrt(1 - equation))
-    distance = radius * c
-    return distance
+def load_store_coordinates():
+    query = datastore_client.query(kind="Store")
+    for store in query.fetch():
+        if store.get("latitude") is not None and store.get("longitude") is not None:
+            yield store.key.id, store["latitude"], store["longitude"]
+
+
+store_locator = geo.StoreLocator(load_store_coordinates)
+
+
+def get_stores_by_ids(store_ids):
+    stores_by_id = get_entities_by_ids("Store", store_ids)
+    return [stores_by_id[store_id] for store_id in store_ids if store_id in stores_by_id]
 
 
 def get_nearby_stores(user_location, radius=25):
     user_lat, user_lon = user_location
-    query = datastore_client.query(kind="Store")
-    stores = list(query.fetch())
-    nearby_stores = []
+    store_ids, _ = store_locator.within(user_lat, user_lon, radius)
+    return get_stores_by_ids(store_ids)
 
-    for store in stores:
-        store_lat = store["latitude"]
-        store_lon = store["longitude"]
-        distance = distance_calculation(user_lat, user_lon, store_lat, store_lon)
-        if distance <= radius:
-            nearby_stores.append(store)
 
-    return nearby_stores
+def get_nearest_stores(user_location, k=10, radius=None):
+    user_lat, user_lon = user_location
+    store_ids, _ = store_locator.nearest(user_lat, user_lon, k, max_km=radius)
+    return get_stores_by_ids(store_ids)
 
 
 def calculate_best_store(shopping_list, user_location):
     stores = get_nearby_stores(user_location)
-    store_totals = {}
-    for store in stores:
-        store_id = store.key.id
-        total_cost = 0
-        valid_store = True
-        for item_id in shopping_list:
-            prices = get_prices_by_item(item_id)
-            if not prices:
-                valid_store = False
-                break
-            best_price = min(
-                prices,
-                key=lambda x: (x['price'], x['sale_status'], -x['timestamp'].timestamp())
-            )
-            total_cost += best_price['price']
-        if valid_store:
-            store_totals[store_id] = total_cost
-    if not store_totals:
+    if not stores:
+        return None
+    store_ids = [store.key.id for store in stores]
+    item_ids = batching.unique(shopping_list)
+    quantities = [shopping_list.count(item_id) for item_id in item_ids]
+    summaries = pricing.fetch_price_summaries(datastore_client, store_ids, item_ids)
+    matrix = pricing.build_price_matrix(store_ids, item_ids, summaries)
+    totals, coverage, best = pricing.rank_stores(matrix, quantities)
+    if best is None:
         return None
-    best_store_id = min(store_totals, key=store_totals.get)
-    best_store = datastore_client.get(datastore_client.key("Store", best_store_id))
-    return best_store
+    return stores[best]
 
 
 # API ENDPOINTS #
@@ -564,13 +837,14 @@ def create_user_post():
     reputation = data.get("reputation", 0)
     if not username or not email or not password:
         return jsonify({"error": "Missing required fields"}), 400
-
-    existing_user = get_user_by_email(email)
-    if existing_user:
-        return jsonify({"error": "User with this email already exists"}), 400
+    if not is_points(reputation):
+        return jsonify({"error": "Invalid reputation"}), 400
 
     password_hash = hash_password(password)
-    user_id = store_user(username, email, password_hash, reputation=reputation, role=role)
+    try:
+        user_id = store_user(username, email, password_hash, reputation=reputation, role=role)
+    except reservations.AlreadyReserved:
+        return jsonify({"error": "User with this email already exists"}), 400
     return jsonify({"message": "User created successfully", "user_id": user_id}), 201
 
 @app.route("/users/<int:user_id>", methods=["GET"])
@@ -583,6 +857,7 @@ def read_user(user_id):
             "email": user["email"],
             "reputation": user["reputation"],
             "role": user["role"],
+            "rank": user_leaderboard.rank_of(user["id"]),
             "timestamp": user["timestamp"].isoformat()
         }
         return jsonify(user_info), 200
@@ -627,6 +902,8 @@ def update_reputation(user_id):
     points = data.get("points")
     if points is None:
         return jsonify({"error": "Missing points"}), 400
+    if not is_points(points):
+        return jsonify({"error": "Invalid points"}), 400
 
     updated_user = update_user_reputation(user_id, points)
     if updated_user:
@@ -634,10 +911,48 @@ def update_reputation(user_id):
     return jsonify({"error": "User not found"}), 404
 
 
+def is_points(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+@app.route("/users/reputation/batch", methods=["POST"])
+def update_reputations_batch():
+    data = request.json
+    updates = data.get("updates")
+    if not isinstance(updates, list) or not updates:
+        return jsonify({"error": "Missing updates"}), 400
+    results = [{"index": index} for index in range(len(updates))]
+    deltas = {}
+    for index, update in enumerate(updates):
+        if not isinstance(update, dict) or not is_points(update.get("user_id")) or update.get("points") is None:
+            results[index]["error"] = "Missing required fields"
+        elif not is_points(update["points"]):
+            results[index]["error"] = "Invalid points"
+        else:
+            # Several updates for one user are applied as their sum.
+            deltas[update["user_id"]] = deltas.get(update["user_id"], 0) + update["points"]
+    users = update_user_reputations(deltas) if deltas else {}
+    for index, update in enumerate(updates):
+        if "error" in results[index]:
+            continue
+        user = users.get(update["user_id"])
+        if user is None:
+            results[index]["error"] = "User not found"
+        else:
+            results[index]["user_id"] = update["user_id"]
+            results[index]["reputation"] = user.get("reputation", 0)
+    status = 200 if all("error" not in result for result in results) else 207
+    return jsonify({"results": results}), status
+
+
 @app.route("/users/rankings", methods=["GET"])
 def user_rankings():
-    rankings = get_user_rankings()
-    return jsonify(rankings), 200
+    limit, cursor = page_args()
+    offset = int(cursor) if cursor and cursor.isdigit() else 0
+    rankings = get_user_rankings(limit, offset)
+    next_offset = offset + len(rankings)
+    next_cursor = str(next_offset) if next_offset < len(user_leaderboard) else None
+    return jsonify({"rankings": rankings, "next_cursor": next_cursor}), 200
 
 
 @app.route("/users/<int:user_id>/badges", methods=["GET"])
@@ -658,11 +973,10 @@ def create_item():
     if not name:
         return jsonify({"error": "Missing required fields"}), 400
 
-    existing_item = get_item_by_name(name)
-    if existing_item:
+    try:
+        item_id = store_item(name, tags, brand)
+    except reservations.AlreadyReserved:
         return jsonify({"error": "Item with this name already exists"}), 400
-
-    item_id = store_item(name, tags, brand)
     return jsonify({"message": "Item created successfully", "item_id": item_id}), 201
 
 
@@ -677,7 +991,10 @@ def read_item(item_id):
 @app.route("/items/<int:item_id>", methods=["PUT"])
 def update_item(item_id):
     data = request.json
-    updated_item = update_item_info(item_id, data)
+    try:
+        updated_item = update_item_info(item_id, data)
+    except reservations.AlreadyReserved:
+        return jsonify({"error": "Item with this name already exists"}), 400
     if updated_item:
         return jsonify({"message": "Item updated successfully"}), 200
     return jsonify({"error": "Item not found"}), 404
@@ -696,17 +1013,32 @@ def create_store():
     data = request.json
     name = data.get("name")
     location = data.get("location")
+    latitude = data.get("latitude")
+    longitude = data.get("longitude")
     if not name or not location:
         return jsonify({"error": "Missing required fields"}), 400
+    if not valid_coordinates(data):
+        return jsonify({"error": "Invalid latitude or longitude"}), 400
 
-    existing_store = get_store_by_name(name)
-    if existing_store:
+    try:
+        store_id = store_store_info(name, location, latitude, longitude)
+    except reservations.AlreadyReserved:
         return jsonify({"error": "Store with this name already exists"}), 400
-
-    store_id = store_store_info(name, location)
     return jsonify({"message": "Store created successfully", "store_id": store_id}), 201
 
 
+def valid_coordinates(data):
+    # A bad coordinate would break every reload of the store locator, so
+    # latitude and longitude are checked before they are stored.
+    for name, bound in (("latitude", 90), ("longitude", 180)):
+        value = data.get(name)
+        if value is None:
+            continue
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not -bound <= value <= bound:
+            return False
+    return True
+
+
 @app.route("/stores/<int:store_id>", methods=["GET"])
 def read_store(store_id):
     store = get_store_by_id(store_id)
@@ -718,7 +1050,12 @@ def read_store(store_id):
 @app.route("/stores/<int:store_id>", methods=["PUT"])
 def update_store(store_id):
     data = request.json
-    updated_store = update_store_info(store_id, data)
+    if not valid_coordinates(data):
+        return jsonify({"error": "Invalid latitude or longitude"}), 400
+    try:
+        updated_store = update_store_info(store_id, data)
+    except reservations.AlreadyReserved:
+        return jsonify({"error": "Store with this name already exists"}), 400
     if updated_store:
         return jsonify({"message": "Store updated successfully"}), 200
     return jsonify({"error": "Store not found"}), 404
@@ -833,18 +1170,48 @@ def update_price():
     sale_status = data.get("sale_status", False)
     if not item_id or not store_id or not price or not user_id:
         return jsonify({"error": "Missing required fields"}), 400
+    price = pricing.parse_price(price)
+    if price is None:
+        return jsonify({"error": "Invalid price"}), 400
     price_id = store_price(item_id, store_id, price, user_id, sale_status)
     return jsonify({"message": "Price updated successfully", "price_id": price_id}), 201
 
 
 @app.route("/prices/<item_id>", methods=["GET"])
 def check_prices(item_id):
-    prices = get_prices_by_item(item_id)
-    if prices:
-        return jsonify(prices), 200
+    limit, cursor = page_args()
+    prices, next_cursor = get_prices_by_item(item_id, limit, cursor)
+    if prices or cursor:
+        return jsonify({"prices": prices, "next_cursor": next_cursor}), 200
     return jsonify({"error": "No prices found for this item"}), 404
 
 
+@app.route("/prices/<int:item_id>/history", methods=["GET"])
+def read_price_history(item_id):
+    # ?resolution=auto|raw|daily|weekly, ?days=N to cut the range, ?store_id=
+    # for one store. Times are Unix seconds, prices in dollars.
+    resolution = request.args.get("resolution", "auto")
+    if resolution not in price_history.RESOLUTIONS:
+        return jsonify({"error": f"resolution must be one of {', '.join(price_history.RESOLUTIONS)}"}), 400
+    days = request.args.get("days", type=int)
+    since = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(days=days) if days else None
+    store_id = request.args.get("store_id")
+
+    # Reports posted with the item id as a string are stored under the string.
+    histories = [history for matches in batching.fetch_in(datastore_client, "PriceHistory", "item_id", [item_id, str(item_id)]).values()
+                 for history in matches]
+    if store_id is not None:
+        histories = [history for history in histories if str(history.get("store_id")) == store_id]
+    if not histories:
+        return jsonify({"error": "No price history for this item"}), 404
+    series = []
+    for history in sorted(histories, key=lambda history: str(history.get("store_id"))):
+        entry = {"store_id": history.get("store_id")}
+        entry.update(price_history.PriceSeries.decode(history["series"]).buckets(resolution, since))
+        series.append(entry)
+    return jsonify({"item_id": item_id, "resolution": resolution, "series": series}), 200
+
+
 @app.route("/prices/compare", methods=["POST"])
 def compare_prices():
     data = request.json
@@ -866,6 +1233,8 @@ def create_activitylog():
         return jsonify({"error": "Missing required fields"}), 400
 
     log_id = store_activitylog(user_id, activity_type, details)
+    if log_id is None:
+        return jsonify({"error": "Activity log could not be recorded"}), 503
     return jsonify({"message": "Activity log created successfully", "log_id": log_id}), 201
 
 
@@ -879,16 +1248,20 @@ def read_activitylog(log_id):
 
 @app.route("/activitylogs/user/<int:user_id>", methods=["GET"])
 def read_activitylog_by_user(user_id):
-    logs = get_activitylog_by_user(user_id)
-    if logs:
-        return jsonify(logs), 200
+    limit, cursor = page_args()
+    logs, next_cursor = get_activitylog_by_user(user_id, limit, cursor)
+    if logs or cursor:
+        return jsonify({"logs": logs, "next_cursor": next_cursor}), 200
     return jsonify({"error": "No activity logs found for this user"}), 404
 
 
 @app.route("/activitylogs/<int:log_id>", methods=["PUT"])
 def update_activitylog(log_id):
     data = request.json
-    updated_log = update_activitylog_info(log_id, data)
+    try:
+        updated_log = update_activitylog_info(log_id, data)
+    except write_behind.NotFlushed:
+        return jsonify({"error": "Activity log busy, try again"}), 503
     if updated_log:
         return jsonify({"message": "Activity log updated successfully"}), 200
     return jsonify({"error": "Activity log not found"}), 404
@@ -896,7 +1269,11 @@ def update_activitylog(log_id):
 
 @app.route("/activitylogs/<int:log_id>", methods=["DELETE"])
 def delete_activitylog_endpoint(log_id):
-    if delete_activitylog(log_id):
+    try:
+        deleted = delete_activitylog(log_id)
+    except write_behind.NotFlushed:
+        return jsonify({"error": "Activity log busy, try again"}), 503
+    if deleted:
         return jsonify({"message": "Activity log deleted successfully"}), 200
     return jsonify({"error": "Activity log not found"}), 404
 
@@ -909,11 +1286,10 @@ def create_tag():
     if not name:
         return jsonify({"error": "Missing required fields"}), 400
 
-    existing_tag = get_tag_by_name(name)
-    if existing_tag:
+    try:
+        tag_id = store_tag(name)
+    except reservations.AlreadyReserved:
         return jsonify({"error": "Tag with this name already exists"}), 400
-
-    tag_id = store_tag(name)
     return jsonify({"message": "Tag created successfully", "tag_id": tag_id}), 201
 
 
@@ -925,10 +1301,43 @@ def read_tag(tag_id):
     return jsonify({"error": "Tag not found"}), 404
 
 
+@app.route("/tags/<int:tag_id>/items", methods=["GET"])
+def read_tag_items(tag_id):
+    # ?tags=organic,12 narrows to items carrying every listed tag too, or any
+    # of them with &match=any. Tags are given by id or name.
+    limit, cursor = page_args()
+    match = request.args.get("match", "all")
+    if match not in ("all", "any"):
+        return jsonify({"error": "match must be all or any"}), 400
+    if cursor is not None and not cursor.isdigit():
+        return jsonify({"error": "Invalid cursor"}), 400
+    others = [value.strip() for value in request.args.get("tags", "").split(",") if value.strip()]
+    values = [tag_id] + [int(value) if value.isdigit() else value for value in others]
+    resolved = tagging.resolve(datastore_client, values)
+    missing = [value for value in values if value not in resolved]
+    if missing:
+        return jsonify({"error": "Tag not found", "tags": missing}), 404
+
+    find = tagging.items_with_all if match == "all" else tagging.items_with_any
+    item_ids, next_cursor = find(datastore_client, [resolved[value] for value in values], limit, cursor)
+    items_by_id = get_entities_by_ids("Item", item_ids)
+    items = []
+    for item_id in item_ids:
+        item = items_by_id.get(item_id)
+        if item:
+            item_info = item.copy()
+            item_info["id"] = item_id
+            items.append(item_info)
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
 @app.route("/tags/<int:tag_id>", methods=["PUT"])
 def update_tag(tag_id):
     data = request.json
-    updated_tag = update_tag_info(tag_id, data)
+    try:
+        updated_tag = update_tag_info(tag_id, data)
+    except reservations.AlreadyReserved:
+        return jsonify({"error": "Tag with this name already exists"}), 400
     if updated_tag:
         return jsonify({"message": "Tag updated successfully"}), 200
     return jsonify({"error": "Tag not found"}), 404
@@ -962,10 +1371,26 @@ def assign_tag_to_brand_endpoint(brand_name):
     if not tag_id:
         return jsonify({"error": "Missing tag_id"}), 400
 
-    updated_items = assign_tag_to_brand(brand_name, tag_id)
-    if updated_items:
-        return jsonify({"message": "Tag assigned to brand successfully"}), 200
-    return jsonify({"error": "Brand not found"}), 404
+    job_id = enqueue_job("assign_tag_to_brand", {"brand_name": brand_name, "tag_id": tag_id})
+    return jsonify({"message": "Tag assignment to brand queued", "job_id": job_id}), 202
+
+
+# JOB STATUS ENDPOINTS
+@app.route("/jobs/<int:job_id>", methods=["GET"])
+def read_job(job_id):
+    job = job_runner.get(job_id)
+    if job:
+        job_info = {
+            "id": job.key.id,
+            "job_type": job["job_type"],
+            "status": job["status"],
+            "processed": job["processed"],
+            "error": job["error"],
+            "created": job["created"].isoformat(),
+            "updated": job["updated"].isoformat()
+        }
+        return jsonify(job_info), 200
+    return jsonify({"error": "Job not found"}), 404
 
 
 # COMMENT MANAGEMENT ENDPOINTS:
@@ -985,9 +1410,10 @@ def create_comment():
 
 @app.route("/comments/<int:item_id>", methods=["GET"])
 def read_comments(item_id):
-    comments = get_comments_by_item(item_id)
-    if comments:
-        return jsonify(comments), 200
+    limit, cursor = page_args()
+    comments, next_cursor = get_comments_by_item(item_id, limit, cursor)
+    if comments or cursor:
+        return jsonify({"comments": comments, "next_cursor": next_cursor}), 200
     return jsonify({"error": "No comments found for this item"}), 404
 
 
@@ -1029,19 +1455,29 @@ def recommend_store():
 # STORE LOCATION ENDPOINT
 @app.route("/stores_nearby")
 def stores_nearby():
-    radius = float(request.args.get('radius'))
-    latitude = float(request.args.get('latitude'))
-    longitude = float(request.args.get('longitude'))
+    radius = request.args.get('radius', type=float)
+    k = request.args.get('k', type=int)
+    latitude = request.args.get('latitude', type=float)
+    longitude = request.args.get('longitude', type=float)
+    if latitude is None or longitude is None:
+        return jsonify({"error": "Missing latitude or longitude"}), 400
+    if k is not None and k <= 0:
+        return jsonify({"error": "k must be positive"}), 400
     user_location = (latitude, longitude)
 
-    stores = get_nearby_stores(user_location, radius)
+    if k:
+        stores = get_nearest_stores(user_location, k, radius)
+    else:
+        stores = get_nearby_stores(user_location, radius if radius is not None else 25)
     return jsonify(stores)
 
 # DATASTORE FETCHING ENDPOINTS
 @app.route("/api/stores", methods=["GET"])
 def get_stores():
+    limit, cursor = page_args()
     query = datastore_client.query(kind="Store")
-    stores = list(query.fetch())
+    query.order = ["__key__"]
+    stores, next_cursor = fetch_page(query, limit, cursor)
     store_list = []
     for store in stores:
         store_data = {
@@ -1050,26 +1486,38 @@ def get_stores():
             "location": store["location"]
         }
         store_list.append(store_data)
-    return jsonify(store_list)
+    return jsonify({"stores": store_list, "next_cursor": next_cursor})
 
 
 @app.route("/api/store/<int:store_id>/items", methods=["GET"])
 def get_items_by_store(store_id):
-    query = datastore_client.query(kind="Price")
+    limit, cursor = page_args()
+    query = datastore_client.query(kind="PriceSummary")
     query.add_filter("store_id", "=", store_id)
-    prices = list(query.fetch())
-    item_ids = {price["item_id"] for price in prices}
+    summaries, next_cursor = fetch_page(query, limit, cursor)
+
+    # One summary per item, already holding the latest reported price.
+    summaries_by_item = {int(summary["item_id"]): summary for summary in summaries}
+    items_by_id = get_entities_by_ids("Item", list(summaries_by_item))
     items = []
-    for item_id in item_ids:
-        item = get_item_by_id(item_id)
+    for item_id, summary in summaries_by_item.items():
+        item = items_by_id.get(item_id)
         if item:
             item_info = item.copy()
-            item_price_info = next(price for price in prices if price["item_id"] == item_id)
-            item_info["price"] = item_price_info["price"]
-            item_info["sale_status"] = item_price_info["sale_status"]
+            item_info["id"] = item_id
+            item_info["price"] = summary["price"]
+            item_info["sale_status"] = summary["sale_status"]
             items.append(item_info)
-    
-    return jsonify(items)
+
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+@app.route("/api/items/search", methods=["GET"])
+def search_items():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Missing q"}), 400
+    limit, _ = page_args(default_limit=20, max_limit=100)
+    return jsonify({"items": item_search.search(query, limit)})
 
 @app.route("/api/item/<int:item_id>", methods=["GET"])
 def get_item(item_id):
@@ -1078,6 +1526,29 @@ def get_item(item_id):
         return jsonify(item)
     return jsonify({"error": "Item not found"}), 404
 
+@app.route("/api/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(entity_cache.stats())
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+# PROFILING ENDPOINTS
+@app.route("/admin/profiles", methods=["GET"])
+def list_profiles():
+    if not profiling.is_admin():
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify({"profiles": profiling.list_profiles()})
+
+
+@app.route("/admin/profiles/<name>", methods=["GET"])
+def download_profile(name):
+    if not profiling.is_admin():
+        return jsonify({"error": "Forbidden"}), 403
+    return send_file(profiling.profile_path(name), mimetype="text/plain")
+
 @app.route("/api/current_user", methods=["GET"])
 def get_current_user():
     user_id = session.get('user_id')
@@ -1114,37 +1585,45 @@ def get_shoppinglist(user_id):
     result = list(query.fetch())
     if result:
         shopping_list = result[0]
-        items = []
-        for item_id in shopping_list["items"]:
-            item = get_item_by_id(item_id)
-            if item:
-                price_info = get_price_info_by_item_id(item_id)  
-                item_data = {
-                    "id": item.key.id,
-                    "name": item["name"],
-                    "brand": item["brand"],
-                    "price": price_info["price"] if price_info else "N/A",
-                    "sale_status": price_info["sale_status"] if price_info else "N/A"
-                }
-                items.append(item_data)
-            else:
-                app.logger.info(f"Item with ID {item_id} not found in datastore.")
-        return jsonify(items), 200
+        items, total = hydrate_shoppinglist_items(shopping_list.get("items", []))
+        return jsonify({"items": items, "total": total}), 200
     return jsonify({"error": "Shopping list not found"}), 404
 
 
+def hydrate_shoppinglist_items(item_ids):
+    item_ids = [int(item_id) for item_id in item_ids]
+    items_by_id = get_entities_by_ids("Item", item_ids)
+    price_infos = get_price_infos_by_item_ids(list(items_by_id))
+    items = []
+    total = 0
+    missing = []
+    for item_id in item_ids:
+        item = items_by_id.get(item_id)
+        if not item:
+            missing.append(item_id)
+            continue
+        price_info = price_infos.get(item_id)
+        items.append({
+            "id": item_id,
+            "name": item.get("name"),
+            "brand": item.get("brand"),
+            "price": price_info["price"] if price_info else "N/A",
+            "sale_status": price_info["sale_status"] if price_info else "N/A"
+        })
+        if price_info:
+            total += price_info["price"]
+    if missing:
+        app.logger.info(f"Items not found in datastore: {missing}")
+    return items, round(total, 2)
+
+
+def get_price_infos_by_item_ids(item_ids):
+    summaries = pricing.fetch_prices_for_items(datastore_client, [int(item_id) for item_id in item_ids], kind="PriceSummary")
+    return pricing.latest_prices(summaries)
+
+
 def get_price_info_by_item_id(item_id):
-    app.logger.info(f"Fetching price info for item_id: {item_id}")
-    query = datastore_client.query(kind="Price")
-    query.add_filter("item_id", "=", int(item_id))
-    result = list(query.fetch())
-    if result:
-        app.logger.info(f"Price info found for item_id {item_id}: {result[0]}")
-        return result[0]
-    else:
-        app.logger.info(f"No price info found for item_id {item_id}")
-    
-    return None
+    return get_price_infos_by_item_ids([item_id]).get(int(item_id))
 
 
 @app.route("/api/shoppinglist/<int:user_id>/remove/<item_id>", methods=["DELETE"])
@@ -1174,6 +1653,12 @@ def scan_item():
 
     if not barcode or not price or user_id is None:
         return jsonify({"error": "Missing required fields"}), 400
+    price = pricing.parse_price(price)
+    if price is None:
+        return jsonify({"error": "Invalid price"}), 400
+    # Tags first, so a new item is created already indexed under them.
+    for tag in tags:
+        store_tag_info(tag)
     item = get_item_by_barcode(barcode)
     if item:
         item_id = item.key.id
@@ -1182,11 +1667,108 @@ def scan_item():
     
     store_price_info(item_id, user_id, price, sale_status)
     for tag in tags:
-        store_tag_info(tag)
         assign_tag_to_item(item_id, tag)
 
     return jsonify({"message": "Item scanned and stored successfully"}), 201
 
+
+@app.route("/api/scan/batch", methods=["POST"])
+def scan_items_batch():
+    data = request.json
+    scans = data.get("scans")
+    if not isinstance(scans, list) or not scans:
+        return jsonify({"error": "Missing scans"}), 400
+    results = store_scan_batch(scans)
+    status = 201 if all("error" not in result for result in results) else 207
+    return jsonify({"results": results}), status
+
+
+def store_scan_batch(scans):
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    results = [{"index": index} for index in range(len(scans))]
+    valid = []
+    for index, scan in enumerate(scans):
+        if not isinstance(scan, dict) or not scan.get("barcode") or not scan.get("price") or scan.get("user_id") is None:
+            results[index]["error"] = "Missing required fields"
+        elif pricing.parse_price(scan["price"]) is None:
+            results[index]["error"] = "Invalid price"
+        else:
+            valid.append((index, dict(scan, price=pricing.parse_price(scan["price"]))))
+    if not valid:
+        return results
+
+    # Tags are deduplicated across the whole batch; only unknown names get a Tag entity.
+    tag_values = batching.unique(tag for _, scan in valid for tag in scan.get("tags") or [])
+    tag_names = [tag for tag in tag_values if isinstance(tag, str) and tag]
+    existing_tags = reservations.lookup_ids(datastore_client, "Tag", tag_names)
+    new_names = [name for name in tag_names if name not in existing_tags]
+    new_tags = []
+    if new_names:
+        for key, name in zip(datastore_client.allocate_ids(datastore_client.key("Tag"), len(new_names)), new_names):
+            tag = datastore.Entity(key=key)
+            tag.update({"name": name, "timestamp": now})
+            new_tags.append(tag)
+    # A name another request reserved in the meantime keeps that request's Tag.
+    reservations.insert_many(datastore_client, new_tags)
+
+    barcodes = batching.unique(scan["barcode"] for _, scan in valid)
+    items_by_barcode = {barcode: matches[0] for barcode, matches in batching.fetch_in(datastore_client, "Item", "barcode", barcodes).items() if matches}
+    new_barcodes = [barcode for barcode in barcodes if barcode not in items_by_barcode]
+    created = set(new_barcodes)
+    if new_barcodes:
+        # New items get their ids now so their tag memberships can be keyed.
+        for key, barcode in zip(datastore_client.allocate_ids(datastore_client.key("Item"), len(new_barcodes)), new_barcodes):
+            item = datastore.Entity(key=key)
+            item.update({"barcode": barcode, "tags": [], "brand": "", "timestamp": now})
+            items_by_barcode[barcode] = item
+    # One resolve for the batch, so a tag an item carries as an id isn't
+    # added again by name.
+    resolved = tagging.resolve(datastore_client, tag_values + [
+        value for item in items_by_barcode.values() for value in item.get("tags") or []])
+    memberships = unit_of_work.UnitOfWork(datastore_client)
+    changed = {barcode: items_by_barcode[barcode] for barcode in new_barcodes}
+    for _, scan in valid:
+        item = items_by_barcode[scan["barcode"]]
+        if tagging.add_tags(datastore_client, memberships, item, scan.get("tags") or [], resolved):
+            changed[scan["barcode"]] = item
+    batching.put_multi(datastore_client, changed.values())
+    memberships.flush()
+    for barcode, item in changed.items():
+        entity_cache.invalidate("Item", item.key.id)
+        index_item(item)
+
+    prices = []
+    for index, scan in valid:
+        item_id = items_by_barcode[scan["barcode"]].key.id
+        price = datastore.Entity(key=datastore_client.key("Price"))
+        price.update({
+            "item_id": item_id,
+            "user_id": scan["user_id"],
+            "price": scan["price"],
+            "sale_status": scan.get("sale_status"),
+            "timestamp": now
+        })
+        prices.append((index, price))
+    batching.put_multi(datastore_client, [price for _, price in prices])
+    # Weighted by reputation as get_user_reputation reads it: string ids
+    # accepted and pending shard points included.
+    user_ids = {index: user_key_id(price["user_id"]) for index, price in prices}
+    users = counters.load_users(datastore_client, [user_id for user_id in user_ids.values() if user_id is not None])
+    store_price_summaries([
+        (price["item_id"], None, price["price"], price["sale_status"], price["timestamp"],
+         users[user_ids[index]].get("reputation") if user_ids[index] in users else None)
+        for index, price in prices
+    ])
+
+    for index, price in prices:
+        results[index].update({
+            "item_id": price["item_id"],
+            "price_id": price.key.id,
+            "created": scans[index]["barcode"] in created
+        })
+    return results
+
+
 def get_item_by_barcode(barcode):
     query = datastore_client.query(kind="Item")
     query.add_filter("barcode", "=", barcode)
@@ -1199,14 +1781,20 @@ def store_item_info(barcode, tags, brand):
     entity = datastore.Entity(key=datastore_client.key("Item"))
     entity.update({
         "barcode": barcode,
-        "tags": tags,
+        "tags": list(tags or []),
         "brand": brand,
         "timestamp": datetime.datetime.now(tz=datetime.timezone.utc)
     })
-    datastore_client.put(entity)
-    return entity.key.id
+    item_id = reserve_id(entity)
+    current_writer().put(entity)
+    tagging.sync(datastore_client, current_writer(), item_id, [], entity["tags"])
+    after_commit(lambda: index_item(entity))
+    return item_id
 
 def store_price_info(item_id, user_id, price, sale_status):
+    price = pricing.parse_price(price)
+    if price is None:
+        raise ValueError("Invalid price")
     entity = datastore.Entity(key=datastore_client.key("Price"))
     entity.update({
         "item_id": item_id,
@@ -1215,50 +1803,67 @@ def store_price_info(item_id, user_id, price, sale_status):
         "sale_status": sale_status,
         "timestamp": datetime.datetime.now(tz=datetime.timezone.utc)
     })
-    datastore_client.put(entity)
-    return entity.key.id
+    price_id = reserve_id(entity)
+    current_writer().put(entity)
+    reputation = get_user_reputation(user_id)
+    after_commit(lambda: store_price_summary(item_id, None, price, sale_status, entity["timestamp"], reputation))
+    return price_id
 
 def store_tag_info(name):
-    entity = datastore.Entity(key=datastore_client.key("Tag"))
+    # Scans name tags freely; reuse the tag that already holds the name. The
+    # write goes out with the request's other writes, so two concurrent first
+    # scans of a new tag can still both create one.
+    writer = current_writer()
+    reservation = writer.get(reservations.reservation_key(datastore_client, "Tag", name))
+    if reservation is not None:
+        return reservation["entity_id"]
+    entity = datastore.Entity(key=datastore_client.allocate_ids(datastore_client.key("Tag"), 1)[0])
     entity.update({
         "name": name,
         "timestamp": datetime.datetime.now(tz=datetime.timezone.utc)
     })
-    datastore_client.put(entity)
+    writer.put_multi([entity, reservations.reservation_for(datastore_client, entity)])
     return entity.key.id
 
 def assign_tag_to_item(item_id, tag_name):
-    item = get_item_by_id(item_id)
+    writer = current_writer()
+    item = writer.get(datastore_client.key("Item", int(item_id)))
     if item:
-        if "tags" not in item:
-            item["tags"] = []
-        item["tags"].append(tag_name)
-        datastore_client.put(item)
+        if tagging.add_tags(datastore_client, writer, item, [tag_name]):
+            writer.put(item)
+
+        def refresh():
+            entity_cache.invalidate("Item", item.key.id)
+            index_item(item)
+        after_commit(refresh)
         return item
     return None 
 
 # USER PAGE ENDPOINTS:
+def badge_for_reputation(reputation):
+    if reputation >= 5000:
+        return "Master Shopper"
+    elif reputation >= 1000:
+        return "Gold Shopper"
+    elif reputation >= 500:
+        return "Silver Shopper"
+    elif reputation >= 100:
+        return "Bronze Shopper"
+    else:
+        return "None"
+
+
 def get_user_badges(user_id):
     user = get_user_by_id(user_id)
     if user:
-        reputation = user["reputation"]
-        if reputation >= 5000:
-            return "Master Shopper"
-        elif reputation >= 1000:
-            return "Gold Shopper"
-        elif reputation >= 500:
-            return "Silver Shopper"
-        elif reputation >= 100:
-            return "Bronze Shopper"
-        else:
-            return "None"
+        return badge_for_reputation(user["reputation"])
     return None
 
 @app.route("/api/users/<int:user_id>", methods=["GET"])
 def get_user(user_id):
     user = get_user_by_id(user_id)
     if user:
-        badge = get_user_badges(user_id)
+        badge = badge_for_reputation(user["reputation"])
         user_info = {
             "email": user["email"],
             "reputation": user["reputation"],
@@ -1269,10 +1874,11 @@ def get_user(user_id):
 
 @app.route("/api/activitylogs/user/<int:user_id>", methods=["GET"])
 def get_activity_logs(user_id):
-    logs = get_activitylog_by_user(user_id)
-    if logs:
+    limit, cursor = page_args()
+    logs, next_cursor = get_activitylog_by_user(user_id, limit, cursor)
+    if logs or cursor:
         activities = [{"details": log["details"]} for log in logs]
-        return jsonify({"activities": activities}), 200
+        return jsonify({"activities": activities, "next_cursor": next_cursor}), 200
     return jsonify({"error": "No activity logs found for this user"}), 404
 
 
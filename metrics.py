@@ -0,0 +1,303 @@
+import math
+import threading
+import time
+
+from flask import g, has_request_context, request
+from google.cloud import datastore
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CALL_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+BACKGROUND = "background"
+
+
+class _Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class _Histogram:
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, label_values, value):
+        counts = self.values.get(label_values)
+        if counts is None:
+            counts = self.values[label_values] = [[0] * len(self.buckets), 0, 0.0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[0][index] += 1
+        counts[1] += 1
+        counts[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (buckets, count, total) in sorted(self.values.items()):
+            for bound, bucket_count in zip(self.buckets, buckets):
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (_number(bound),))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+def _number(value):
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _labels(names, values):
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+_lock = threading.Lock()
+datastore_calls = _Counter("datastore_calls_total", "Datastore operations by endpoint.", ("endpoint", "operation", "kind"))
+datastore_entities = _Counter("datastore_entities_total", "Entities read or written by Datastore operations.", ("endpoint", "operation", "kind"))
+datastore_bytes = _Counter("datastore_bytes_total", "Approximate encoded size of entities read or written.", ("endpoint", "operation", "kind"))
+datastore_latency = _Histogram("datastore_operation_seconds", "Datastore operation latency.", ("endpoint", "operation", "kind"), LATENCY_BUCKETS)
+request_latency = _Histogram("http_request_duration_seconds", "Request latency.", ("endpoint", "method", "status"), LATENCY_BUCKETS)
+request_calls = _Histogram("http_request_datastore_calls", "Datastore calls made while serving one request.", ("endpoint",), CALL_BUCKETS)
+buffered_writes = _Counter("buffered_writes_total", "Entities handed to write-behind buffers, by outcome.", ("kind", "outcome"))
+_metrics = (datastore_calls, datastore_entities, datastore_bytes, datastore_latency, request_latency, request_calls,
+            buffered_writes)
+
+
+def _endpoint():
+    if has_request_context():
+        return request.endpoint or "unmatched"
+    return BACKGROUND
+
+
+# Approximates the encoded size from the values themselves. Converting each
+# entity to a protobuf gives the exact figure but cost more than the query.
+def _value_bytes(value):
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (list, tuple)):
+        return sum(_value_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(len(name) + _value_bytes(item) for name, item in value.items())
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, datastore.Key):
+        return sum(_value_bytes(part) for part in value.flat_path)
+    return 8
+
+
+def _entity_bytes(entities):
+    return sum(_value_bytes(entity.key) + _value_bytes(entity) for entity in entities)
+
+
+def record_datastore(operation, kind, seconds, entities=(), calls=1, entity_count=None):
+    labels = (_endpoint(), operation, kind or "")
+    if entity_count is None:
+        entity_count = len(entities)
+    byte_count = _entity_bytes(entities)
+    with _lock:
+        datastore_calls.inc(labels, calls)
+        datastore_entities.inc(labels, entity_count)
+        datastore_bytes.inc(labels, byte_count)
+        if calls:
+            datastore_latency.observe(labels, seconds)
+        if has_request_context():
+            timings = g.setdefault("datastore_timings", {})
+            calls_so_far, total = timings.get(operation, (0, 0.0))
+            timings[operation] = (calls_so_far + calls, total + seconds)
+
+
+def record_buffered(kind, outcome, count=1):
+    with _lock:
+        buffered_writes.inc((kind or "", outcome), count)
+
+
+def render():
+    with _lock:
+        lines = []
+        for metric in _metrics:
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Registers request timing and the Server-Timing header on a Flask app.
+# Install it before other after_request hooks so it runs after them and
+# the writes they flush are included.
+def install(app):
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("request_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        timings = g.pop("datastore_timings", {})
+        endpoint = request.endpoint or "unmatched"
+        with _lock:
+            request_latency.observe((endpoint, request.method, str(response.status_code)), elapsed)
+            request_calls.observe((endpoint,), sum(calls for calls, _ in timings.values()))
+        entries = [f'datastore-{operation};desc="{calls} calls";dur={total * 1000:.2f}'
+                   for operation, (calls, total) in sorted(timings.items()) if calls]
+        entries.append(f"app;dur={elapsed * 1000:.2f}")
+        response.headers.add("Server-Timing", ", ".join(entries))
+        return response
+
+
+def _kind_of_keys(keys):
+    return keys[0].kind if keys else None
+
+
+class _InstrumentedIterator:
+    def __init__(self, iterator, kind, fetch_seconds):
+        self._iterator = iterator
+        self._kind = kind
+        # Local backends run the query inside fetch(); charge that to the first page.
+        self._fetch_seconds = fetch_seconds
+
+    @property
+    def next_page_token(self):
+        return self._iterator.next_page_token
+
+    @property
+    def pages(self):
+        # Each page is one RunQuery RPC, made when the next page is requested.
+        pages = iter(self._iterator.pages)
+        while True:
+            start = time.perf_counter()
+            try:
+                page = list(next(pages))
+            except StopIteration:
+                return
+            elapsed = time.perf_counter() - start + self._fetch_seconds
+            self._fetch_seconds = 0.0
+            record_datastore("query", self._kind, elapsed, page)
+            yield iter(page)
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+
+class _InstrumentedQuery:
+    def __init__(self, query):
+        self._query = query
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+    def __setattr__(self, name, value):
+        if name == "_query":
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._query, name, value)
+
+    def fetch(self, *args, **kwargs):
+        start = time.perf_counter()
+        iterator = self._query.fetch(*args, **kwargs)
+        return _InstrumentedIterator(iterator, self._query.kind, time.perf_counter() - start)
+
+
+class _InstrumentedTransaction:
+    def __init__(self, client, transaction):
+        self._client = client
+        self._transaction = transaction
+
+    def __getattr__(self, name):
+        return getattr(self._transaction, name)
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self._transaction.__enter__()
+        record_datastore("begin_transaction", None, time.perf_counter() - start)
+        self._client._depth.value = getattr(self._client._depth, "value", 0) + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._client._depth.value -= 1
+        start = time.perf_counter()
+        try:
+            return self._transaction.__exit__(exc_type, exc_value, traceback)
+        finally:
+            record_datastore("rollback" if exc_type else "commit", None, time.perf_counter() - start)
+
+
+# Wraps a storage client and records every operation against the endpoint
+# being served. Writes inside a transaction are counted as entities only;
+# the commit is the RPC.
+class InstrumentedClient:
+    def __init__(self, client):
+        self._client = client
+        self._depth = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _write_calls(self):
+        return 0 if getattr(self._depth, "value", 0) else 1
+
+    def query(self, *args, **kwargs):
+        return _InstrumentedQuery(self._client.query(*args, **kwargs))
+
+    def transaction(self, *args, **kwargs):
+        return _InstrumentedTransaction(self, self._client.transaction(*args, **kwargs))
+
+    def get(self, key, *args, **kwargs):
+        start = time.perf_counter()
+        entity = self._client.get(key, *args, **kwargs)
+        record_datastore("get", key.kind, time.perf_counter() - start, [entity] if entity is not None else [])
+        return entity
+
+    def get_multi(self, keys, *args, **kwargs):
+        start = time.perf_counter()
+        entities = self._client.get_multi(keys, *args, **kwargs)
+        record_datastore("get", _kind_of_keys(keys), time.perf_counter() - start, entities)
+        return entities
+
+    def put(self, entity, *args, **kwargs):
+        start = time.perf_counter()
+        self._client.put(entity, *args, **kwargs)
+        record_datastore("put", entity.key.kind, time.perf_counter() - start, [entity], self._write_calls())
+
+    def put_multi(self, entities, *args, **kwargs):
+        entities = list(entities)
+        start = time.perf_counter()
+        self._client.put_multi(entities, *args, **kwargs)
+        record_datastore("put", entities[0].key.kind if entities else None, time.perf_counter() - start, entities, self._write_calls())
+
+    def delete(self, key, *args, **kwargs):
+        start = time.perf_counter()
+        self._client.delete(key, *args, **kwargs)
+        record_datastore("delete", key.kind, time.perf_counter() - start, calls=self._write_calls(), entity_count=1)
+
+    def delete_multi(self, keys, *args, **kwargs):
+        keys = list(keys)
+        start = time.perf_counter()
+        self._client.delete_multi(keys, *args, **kwargs)
+        record_datastore("delete", _kind_of_keys(keys), time.perf_counter() - start, calls=self._write_calls(), entity_count=len(keys))
+
+    def allocate_ids(self, incomplete_key, num_ids, *args, **kwargs):
+        start = time.perf_counter()
+        keys = self._client.allocate_ids(incomplete_key, num_ids, *args, **kwargs)
+        record_datastore("allocate_ids", incomplete_key.kind, time.perf_counter() - start)
+        return keys
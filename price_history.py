@@ -0,0 +1,209 @@
+import datetime
+import struct
+import zlib
+
+import numpy as np
+
+from google.cloud import datastore
+
+# Reports from the last RAW_WINDOW are kept as they came in. Older ones are
+# folded into one min/max/last bucket per day, and buckets older than
+# DAILY_WINDOW into one per week, so a series stays a few KB however long it
+# runs.
+RAW_WINDOW = datetime.timedelta(days=30)
+DAILY_WINDOW = datetime.timedelta(days=365)
+# Very busy series roll their oldest raw reports into days early.
+MAX_RAW_POINTS = 1000
+DAY = 86400
+WEEK = 7 * DAY
+# 1970-01-01 was a Thursday; shifting by three days starts weeks on Monday.
+WEEK_OFFSET = 3 * DAY
+RESOLUTIONS = ("auto", "raw", "daily", "weekly")
+ENCODING_VERSION = 1
+_HEADER = struct.Struct("<BIII")
+
+
+def _seconds(timestamp):
+    if isinstance(timestamp, datetime.datetime):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+        return int(timestamp.timestamp())
+    return int(timestamp)
+
+
+def _cents(price):
+    return int(round(float(price) * 100))
+
+
+def _period_start(seconds, length):
+    if length == WEEK:
+        return (seconds + WEEK_OFFSET) // WEEK * WEEK - WEEK_OFFSET
+    return seconds // length * length
+
+
+def _deltas(values):
+    values = np.asarray(values, dtype=np.int64)
+    return np.diff(values, prepend=np.int64(0))
+
+
+def _undelta(deltas):
+    return np.cumsum(np.asarray(deltas, dtype=np.int64))
+
+
+# The price history of one item at one store: raw reports as (seconds,
+# cents, on_sale) and day and week buckets as [start, min, max, last, count],
+# all in time order.
+class PriceSeries:
+    def __init__(self, points=None, daily=None, weekly=None):
+        self.points = points or []
+        self.daily = daily or []
+        self.weekly = weekly or []
+
+    def __len__(self):
+        return len(self.points) + sum(bucket[4] for bucket in self.daily) + sum(bucket[4] for bucket in self.weekly)
+
+    def add(self, timestamp, price, sale_status=False):
+        point = (_seconds(timestamp), _cents(price), bool(sale_status))
+        if self.points and point[0] < self.points[-1][0]:
+            # Late reports are rare; keep the raw list sorted.
+            position = len(self.points)
+            while position and self.points[position - 1][0] > point[0]:
+                position -= 1
+            self.points.insert(position, point)
+        else:
+            self.points.append(point)
+        self.compact()
+
+    def compact(self, now=None):
+        # Ages are measured from the newest report, so replaying old reports
+        # builds the same series as receiving them live.
+        if not self.points:
+            return
+        now = max(_seconds(now) if now is not None else 0, self.points[-1][0])
+        raw_cutoff = now - int(RAW_WINDOW.total_seconds())
+        keep = len(self.points) - MAX_RAW_POINTS
+        rolled = [point for index, point in enumerate(self.points) if point[0] < raw_cutoff or index < keep]
+        if rolled:
+            self.points = self.points[len(rolled):]
+            for seconds, cents, _ in rolled:
+                _fold(self.daily, _period_start(seconds, DAY), cents, cents, cents, 1)
+
+        daily_cutoff = now - int(DAILY_WINDOW.total_seconds())
+        while self.daily and self.daily[0][0] < daily_cutoff:
+            start, low, high, last, count = self.daily.pop(0)
+            _fold(self.weekly, _period_start(start, WEEK), low, high, last, count)
+
+    def encode(self):
+        # Timestamps and bucket starts are stored as deltas from the previous
+        # one and prices as integer cents, then the arrays are compressed.
+        parts = [_HEADER.pack(ENCODING_VERSION, len(self.points), len(self.daily), len(self.weekly))]
+        if self.points:
+            seconds, cents, sale = zip(*self.points)
+            parts += [_deltas(seconds).astype("<i8").tobytes(), np.asarray(cents, dtype="<i4").tobytes(),
+                      np.asarray(sale, dtype=np.uint8).tobytes()]
+        for buckets in (self.daily, self.weekly):
+            if buckets:
+                columns = list(zip(*buckets))
+                parts += [_deltas(columns[0]).astype("<i8").tobytes(), np.asarray(columns[1:], dtype="<i4").tobytes()]
+        return zlib.compress(b"".join(parts))
+
+    @classmethod
+    def decode(cls, blob):
+        if not blob:
+            return cls()
+        data = zlib.decompress(blob)
+        version, point_count, daily_count, weekly_count = _HEADER.unpack_from(data)
+        if version != ENCODING_VERSION:
+            raise ValueError(f"unknown price history encoding {version}")
+        offset = _HEADER.size
+
+        def read(dtype, count):
+            nonlocal offset
+            array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += array.nbytes
+            return array
+
+        series = cls()
+        if point_count:
+            seconds = _undelta(read("<i8", point_count))
+            cents = read("<i4", point_count)
+            sale = read(np.uint8, point_count)
+            series.points = [(int(s), int(c), bool(f)) for s, c, f in zip(seconds, cents, sale)]
+        for name, count in (("daily", daily_count), ("weekly", weekly_count)):
+            if count:
+                starts = _undelta(read("<i8", count))
+                low, high, last, counts = read("<i4", 4 * count).reshape(4, count)
+                setattr(series, name, [[int(start), int(l), int(h), int(la), int(c)]
+                                       for start, l, h, la, c in zip(starts, low, high, last, counts)])
+        return series
+
+    def buckets(self, resolution="auto", since=None):
+        # Chart-ready columns. "auto" returns each stretch at the resolution
+        # it is stored in; "daily" and "weekly" regroup the finer data, and
+        # "raw" returns only the reports still kept individually.
+        since = _seconds(since) if since is not None else None
+        rows = []
+        if resolution in ("auto", "daily", "weekly"):
+            rows += [list(bucket) for bucket in self.weekly]
+            rows += [list(bucket) for bucket in self.daily]
+        rows += [[seconds, cents, cents, cents, 1] for seconds, cents, _ in self.points]
+        length = {"daily": DAY, "weekly": WEEK}.get(resolution)
+        if length is not None:
+            grouped = []
+            for start, low, high, last, count in rows:
+                period = _period_start(start, length)
+                # Weekly buckets don't split into days; keep them as they are.
+                if grouped and grouped[-1][0] >= period:
+                    _fold(grouped, grouped[-1][0], low, high, last, count)
+                else:
+                    grouped.append([period, low, high, last, count])
+            rows = grouped
+        if since is not None:
+            rows = [row for row in rows if row[0] >= since]
+        return {
+            "t": [row[0] for row in rows],
+            "min": [row[1] / 100 for row in rows],
+            "max": [row[2] / 100 for row in rows],
+            "last": [row[3] / 100 for row in rows],
+            "count": [row[4] for row in rows],
+        }
+
+
+def _fold(buckets, start, low, high, last, count):
+    # Buckets arrive in time order. A late report only widens the bucket it
+    # falls in, unless that is the newest bucket.
+    for bucket in reversed(buckets):
+        if bucket[0] == start:
+            bucket[1] = min(bucket[1], low)
+            bucket[2] = max(bucket[2], high)
+            if bucket is buckets[-1]:
+                bucket[3] = last
+            bucket[4] += count
+            return
+        if bucket[0] < start:
+            break
+    buckets.append([start, low, high, last, count])
+    if len(buckets) > 1 and buckets[-2][0] > start:
+        buckets.sort(key=lambda bucket: bucket[0])
+
+
+def history_entity(key, item_id, store_id, series, observation_count):
+    # For bulk rebuilds that fold many reports into a PriceSeries first.
+    history = datastore.Entity(key=key, exclude_from_indexes=("series",))
+    history.update({
+        "item_id": item_id,
+        "store_id": store_id,
+        "series": series.encode(),
+        "observation_count": observation_count,
+    })
+    return history
+
+
+def apply_price_observation(history, item_id, store_id, price, sale_status, timestamp):
+    series = PriceSeries.decode(history.get("series"))
+    series.add(timestamp, price, sale_status)
+    history["item_id"] = item_id
+    history["store_id"] = store_id
+    history["series"] = series.encode()
+    history["observation_count"] = history.get("observation_count", 0) + 1
+    return history
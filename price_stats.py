@@ -0,0 +1,200 @@
+import math
+
+# Robust per-(item, store) price statistics, updated one report at a time
+# and stored on the PriceSummary so reading them costs nothing extra:
+#
+#   median_price    P-square estimate of the median of accepted reports
+#   robust_price    reputation-weighted mean of accepted reports, decayed
+#                   with MEAN_HALF_LIFE so it follows price changes
+#   rejected_count  reports dropped as outliers
+#
+# A report is an outlier when it is further from the median than both
+# OUTLIER_DEVIATIONS mean absolute deviations and OUTLIER_RELATIVE of the
+# median, so a $0.01 typo for a $3 item is dropped while sale prices are not.
+# REGIME_RUN outliers in a row on the same side mean the price really
+# changed; the statistics restart from them.
+#
+# The first MIN_REPORTS reports are held back and both prices are their
+# median. Once there are enough, they are screened against each other using
+# the median absolute deviation, and only the ones that pass start the
+# statistics, so an early typo never reaches the mean.
+MIN_REPORTS = 5
+OUTLIER_DEVIATIONS = 4.0
+OUTLIER_RELATIVE = 0.5
+REGIME_RUN = 3
+DEVIATION_SMOOTHING = 0.1
+MEAN_HALF_LIFE = 14 * 86400
+STATE_PROPERTIES = (
+    "median_heights", "median_positions", "median_desired", "median_count", "mean_deviation",
+    "weighted_sum", "weight_total", "weighted_at", "rejected_run", "rejected_count",
+    "warmup_prices", "warmup_seconds", "warmup_weights",
+)
+MEDIAN_INCREMENTS = (0.0, 0.25, 0.5, 0.75, 1.0)
+
+
+def reputation_weight(reputation):
+    # Every report counts; a 10,000-point reporter counts five times as much
+    # as a new one.
+    return 1.0 + math.log10(1.0 + max(reputation or 0, 0))
+
+
+def _seconds(timestamp):
+    return timestamp.timestamp() if hasattr(timestamp, "timestamp") else float(timestamp)
+
+
+# The P-square algorithm (Jain and Chlamtac, 1985) for the median: five
+# markers whose heights track the minimum, quartiles, median and maximum,
+# moved by piecewise-parabolic interpolation as reports arrive.
+def _median_update(summary, value):
+    heights = list(summary.get("median_heights") or [])
+    count = summary.get("median_count", 0) + 1
+    summary["median_count"] = count
+    if count <= 5:
+        heights.append(value)
+        heights.sort()
+        summary["median_heights"] = heights
+        if count == 5:
+            summary["median_positions"] = [1, 2, 3, 4, 5]
+            summary["median_desired"] = [1.0, 2.0, 3.0, 4.0, 5.0]
+        return
+
+    positions = list(summary["median_positions"])
+    desired = list(summary["median_desired"])
+    if value < heights[0]:
+        heights[0] = value
+        cell = 0
+    elif value >= heights[4]:
+        heights[4] = value
+        cell = 3
+    else:
+        cell = max(index for index in range(4) if heights[index] <= value)
+    for index in range(cell + 1, 5):
+        positions[index] += 1
+    for index in range(5):
+        desired[index] += MEDIAN_INCREMENTS[index]
+
+    for index in (1, 2, 3):
+        offset = desired[index] - positions[index]
+        if (offset >= 1 and positions[index + 1] - positions[index] > 1) or \
+                (offset <= -1 and positions[index - 1] - positions[index] < -1):
+            step = 1 if offset > 0 else -1
+            height = _parabolic(heights, positions, index, step)
+            if not heights[index - 1] < height < heights[index + 1]:
+                height = heights[index] + step * (heights[index + step] - heights[index]) / (positions[index + step] - positions[index])
+            heights[index] = height
+            positions[index] += step
+    summary["median_heights"] = heights
+    summary["median_positions"] = positions
+    summary["median_desired"] = desired
+
+
+def _parabolic(heights, positions, index, step):
+    below = positions[index] - positions[index - 1]
+    above = positions[index + 1] - positions[index]
+    return heights[index] + step / (positions[index + 1] - positions[index - 1]) * (
+        (below + step) * (heights[index + 1] - heights[index]) / above
+        + (above - step) * (heights[index] - heights[index - 1]) / below
+    )
+
+
+def median(summary):
+    heights = summary.get("median_heights") or []
+    if not heights:
+        return None
+    if len(heights) == 5 and summary.get("median_count", 0) >= 5:
+        return heights[2]
+    middle = len(heights) // 2
+    return heights[middle] if len(heights) % 2 else (heights[middle - 1] + heights[middle]) / 2
+
+
+def is_outlier(summary, price):
+    if not summary.get("median_count"):
+        return False
+    center = median(summary)
+    band = max(OUTLIER_DEVIATIONS * summary.get("mean_deviation", 0.0), OUTLIER_RELATIVE * abs(center))
+    return abs(price - center) > band
+
+
+def _exact_median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def _warm_up(summary, price, seconds, weight):
+    prices = list(summary.get("warmup_prices") or []) + [price]
+    times = list(summary.get("warmup_seconds") or []) + [seconds]
+    weights = list(summary.get("warmup_weights") or []) + [weight]
+    if len(prices) < MIN_REPORTS:
+        summary["warmup_prices"], summary["warmup_seconds"], summary["warmup_weights"] = prices, times, weights
+        summary["robust_price"] = summary["median_price"] = _exact_median(prices)
+        return
+    for name in ("warmup_prices", "warmup_seconds", "warmup_weights"):
+        summary.pop(name, None)
+    center = _exact_median(prices)
+    spread = _exact_median([abs(value - center) for value in prices])
+    band = max(OUTLIER_DEVIATIONS * spread, OUTLIER_RELATIVE * abs(center))
+    for value, at, report_weight in sorted(zip(prices, times, weights), key=lambda report: report[1]):
+        if abs(value - center) > band:
+            summary["rejected_count"] = summary.get("rejected_count", 0) + 1
+        else:
+            _accept(summary, value, at, report_weight)
+    summary["rejected_run"] = []
+    summary["robust_price"] = summary["weighted_sum"] / summary["weight_total"]
+    summary["median_price"] = median(summary)
+
+
+def _reset(summary):
+    for name in STATE_PROPERTIES:
+        if name != "rejected_count":
+            summary.pop(name, None)
+
+
+def _accept(summary, price, seconds, weight):
+    center = median(summary)
+    if center is not None:
+        deviation = summary.get("mean_deviation")
+        distance = abs(price - center)
+        summary["mean_deviation"] = distance if deviation is None else deviation + DEVIATION_SMOOTHING * (distance - deviation)
+    _median_update(summary, price)
+
+    # Decay the older side so the newest report always counts in full,
+    # whichever order reports arrive in.
+    last = summary.get("weighted_at")
+    total = summary.get("weight_total", 0.0)
+    weighted = summary.get("weighted_sum", 0.0)
+    if last is None or seconds >= last:
+        factor = 0.5 ** ((seconds - last) / MEAN_HALF_LIFE) if last is not None else 1.0
+        total, weighted = total * factor, weighted * factor
+        summary["weighted_at"] = seconds
+    else:
+        weight *= 0.5 ** ((last - seconds) / MEAN_HALF_LIFE)
+    summary["weight_total"] = total + weight
+    summary["weighted_sum"] = weighted + weight * price
+
+
+def observe(summary, price, timestamp, reputation=None):
+    price = float(price)
+    seconds = _seconds(timestamp)
+    weight = reputation_weight(reputation)
+    if not summary.get("median_count"):
+        _warm_up(summary, price, seconds, weight)
+        return summary
+    if is_outlier(summary, price):
+        summary["rejected_count"] = summary.get("rejected_count", 0) + 1
+        center = median(summary)
+        run = [value for value in summary.get("rejected_run") or [] if (value > center) == (price > center)]
+        run.append(price)
+        if len(run) < REGIME_RUN:
+            summary["rejected_run"] = run
+            summary["robust_price"] = summary["weighted_sum"] / summary["weight_total"]
+            summary["median_price"] = center
+            return summary
+        _reset(summary)
+        for value in run[:-1]:
+            _accept(summary, value, seconds, weight)
+    _accept(summary, price, seconds, weight)
+    summary["rejected_run"] = []
+    summary["robust_price"] = summary["weighted_sum"] / summary["weight_total"]
+    summary["median_price"] = median(summary)
+    return summary
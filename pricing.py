@@ -0,0 +1,126 @@
+import datetime
+import math
+
+import numpy as np
+
+import batching
+import price_stats
+
+# PriceSummary keeps the prices reported in this window for lowest_recent_price.
+RECENT_WINDOW = datetime.timedelta(days=30)
+MAX_RECENT_PRICES = 20
+SUMMARY_UNINDEXED = ("recent_prices", "recent_timestamps", "robust_price", "median_price") + price_stats.STATE_PROPERTIES
+
+# Prices come in as JSON numbers or numeric strings ("3.50"). Returns the
+# price as a float, or None if it isn't a finite, non-negative number.
+def parse_price(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        price = float(value)
+    except ValueError:
+        return None
+    if not math.isfinite(price) or price < 0:
+        return None
+    return price
+
+
+def fetch_prices_for_items(client, item_ids, kind="Price"):
+    return batching.fetch_in(client, kind, "item_id", item_ids)
+
+
+def comparable_price(price):
+    # Summaries carry an outlier-resistant estimate; raw reports only their price.
+    robust = price.get("robust_price")
+    return price["price"] if robust is None else robust
+
+
+def best_prices(prices_by_item):
+    best = {}
+    for item_id, prices in prices_by_item.items():
+        best_price = None
+        for price in prices:
+            if best_price is None or comparable_price(price) < comparable_price(best_price):
+                best_price = price
+        best[item_id] = best_price
+    return best
+
+
+def latest_prices(prices_by_item):
+    latest = {}
+    for item_id, prices in prices_by_item.items():
+        latest_price = None
+        for price in prices:
+            if latest_price is None or price["timestamp"] > latest_price["timestamp"]:
+                latest_price = price
+        latest[item_id] = latest_price
+    return latest
+
+
+def build_price_matrix(store_ids, item_ids, prices):
+    # Ids are matched as strings; reports may carry "12" where keys carry 12.
+    store_index = {str(store_id): row for row, store_id in enumerate(store_ids)}
+    item_index = {str(item_id): col for col, item_id in enumerate(item_ids)}
+    rows, cols, values = [], [], []
+    for price in prices:
+        row = store_index.get(str(price.get("store_id")))
+        col = item_index.get(str(price.get("item_id")))
+        if row is None or col is None:
+            continue
+        rows.append(row)
+        cols.append(col)
+        values.append(comparable_price(price))
+
+    # NaN marks an item the store has no price for; fmin keeps the lowest
+    # observed price when a cell has several reports.
+    matrix = np.full((len(store_ids), len(item_ids)), np.nan)
+    if values:
+        np.fmin.at(matrix, (np.array(rows), np.array(cols)), np.array(values, dtype=np.float64))
+    return matrix
+
+
+def rank_stores(matrix, quantities=None):
+    if quantities is None:
+        quantities = np.ones(matrix.shape[1])
+    coverage = np.count_nonzero(~np.isnan(matrix), axis=1)
+    totals = np.nansum(matrix * quantities, axis=1)
+    complete = coverage == matrix.shape[1]
+    best = int(np.argmin(np.where(complete, totals, np.inf))) if complete.any() else None
+    return totals, coverage, best
+
+
+def summary_key_name(item_id, store_id):
+    return f"{item_id}:{store_id}"
+
+
+def fetch_price_summaries(client, store_ids, item_ids):
+    keys = [
+        client.key("PriceSummary", summary_key_name(item_id, store_id))
+        for store_id in store_ids
+        for item_id in item_ids
+    ]
+    return batching.get_multi(client, keys)
+
+
+def apply_price_observation(summary, item_id, store_id, price, sale_status, timestamp, reputation=None):
+    # PriceSummary mirrors the Price fields (price, sale_status, timestamp) for
+    # the latest report, so code written against Price entities reads it as is.
+    summary.exclude_from_indexes.update(SUMMARY_UNINDEXED)
+    summary["item_id"] = item_id
+    summary["store_id"] = store_id
+    if summary.get("timestamp") is None or timestamp >= summary["timestamp"]:
+        summary["price"] = price
+        summary["sale_status"] = sale_status
+        summary["timestamp"] = timestamp
+
+    recent = list(zip(summary.get("recent_timestamps", []), summary.get("recent_prices", [])))
+    recent.append((timestamp, price))
+    recent.sort(key=lambda observation: observation[0])
+    cutoff = recent[-1][0] - RECENT_WINDOW
+    recent = [observation for observation in recent if observation[0] >= cutoff][-MAX_RECENT_PRICES:]
+    summary["recent_timestamps"] = [observation[0] for observation in recent]
+    summary["recent_prices"] = [observation[1] for observation in recent]
+    summary["lowest_recent_price"] = min(summary["recent_prices"])
+    summary["observation_count"] = summary.get("observation_count", 0) + 1
+    price_stats.observe(summary, price, timestamp, reputation)
+    return summary
@@ -0,0 +1,196 @@
+import datetime
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from flask import abort, g, request
+
+# App Engine only lets instances write under /tmp.
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "profiles")
+# Fraction of ordinary requests profiled with the sampler, e.g. 0.01.
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+SAMPLE_INTERVAL = 0.002
+MAX_STACK_DEPTH = 128
+MAX_PROFILES = 500
+MODES = ("sample", "trace")
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_label(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}".replace(";", ":").replace(" ", "_")
+
+
+# Samples the stack of one thread from a background thread every
+# SAMPLE_INTERVAL seconds. Counts are samples per collapsed stack.
+class StackSampler:
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if labels:
+                stack = ";".join(reversed(labels))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+# Deterministic profiler on sys.setprofile for the calling thread. Every
+# Python and C call is seen, so counts are exact self time in microseconds,
+# at the price of slowing the request down several times.
+class CallTracer:
+    def __init__(self):
+        self.stacks = {}
+        self._path = []
+        self._last = None
+
+    def _charge(self, now):
+        if self._path:
+            stack = ";".join(self._path)
+            self.stacks[stack] = self.stacks.get(stack, 0) + int((now - self._last) * 1_000_000)
+        self._last = now
+
+    def _profile(self, frame, event, arg):
+        now = time.perf_counter()
+        self._charge(now)
+        if event == "call":
+            self._path.append(_frame_label(frame.f_code))
+        elif event == "c_call":
+            self._path.append(f"builtins:{getattr(arg, '__name__', 'c_function')}")
+        elif event in ("return", "c_return", "c_exception"):
+            if self._path:
+                self._path.pop()
+
+    def start(self):
+        self._last = time.perf_counter()
+        sys.setprofile(self._profile)
+
+    def stop(self):
+        sys.setprofile(None)
+        self._charge(time.perf_counter())
+        return {stack: count for stack, count in self.stacks.items() if count}
+
+
+def is_admin():
+    token = os.environ.get("ADMIN_TOKEN")
+    supplied = request.headers.get("X-Admin-Token", "")
+    return bool(token) and hmac.compare_digest(token.encode("utf-8"), supplied.encode("utf-8"))
+
+
+def requested_mode():
+    mode = request.headers.get("X-Profile") or request.args.get("profile")
+    if not mode:
+        return None
+    return mode if mode in MODES else "sample"
+
+
+def write_profile(endpoint, mode, stacks, directory=PROFILE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y%m%dT%H%M%S")
+    safe_endpoint = re.sub(r"[^A-Za-z0-9_.-]", "_", endpoint or "unmatched")
+    name = f"{stamp}-{safe_endpoint}-{mode}-{uuid.uuid4().hex[:8]}.folded"
+    with open(os.path.join(directory, name), "w") as output:
+        for stack, count in sorted(stacks.items()):
+            output.write(f"{stack} {count}\n")
+    _prune(directory)
+    return name
+
+
+def _prune(directory):
+    names = sorted(name for name in os.listdir(directory) if name.endswith(".folded"))
+    for name in names[:-MAX_PROFILES]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def list_profiles(directory=PROFILE_DIR):
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not name.endswith(".folded"):
+            continue
+        info = os.stat(os.path.join(directory, name))
+        profiles.append({
+            "name": name,
+            "bytes": info.st_size,
+            "created": datetime.datetime.fromtimestamp(info.st_mtime, tz=datetime.timezone.utc).isoformat(),
+        })
+    return profiles
+
+
+def profile_path(name, directory=PROFILE_DIR):
+    if os.path.basename(name) != name or not name.endswith(".folded"):
+        abort(404)
+    path = os.path.join(directory, name)
+    if not os.path.isfile(path):
+        abort(404)
+    return path
+
+
+# Profiles a request when an admin asks for it (X-Profile header or
+# ?profile=sample|trace, plus X-Admin-Token) and a PROFILE_SAMPLE_RATE share
+# of all other requests with the sampler. Output is written as collapsed
+# stacks, one "frame;frame;frame count" line each, for flamegraph tools.
+def install(app):
+    @app.before_request
+    def start_profiler():
+        mode = requested_mode()
+        if mode is not None and not is_admin():
+            mode = None
+        if mode is None and PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            mode = "sample"
+        if mode is None:
+            return
+        profiler = CallTracer() if mode == "trace" else StackSampler(threading.get_ident())
+        g.profiler = (mode, profiler)
+        profiler.start()
+
+    @app.after_request
+    def stop_profiler(response):
+        active = g.pop("profiler", None)
+        if active is None:
+            return response
+        mode, profiler = active
+        stacks = profiler.stop()
+        try:
+            name = write_profile(request.endpoint, mode, stacks)
+        except OSError:
+            # The request itself succeeded; losing its profile shouldn't fail it.
+            logger.exception("Could not write profile to %s", PROFILE_DIR)
+            return response
+        response.headers["X-Profile-Id"] = name
+        return response
+
+    @app.teardown_request
+    def discard_profiler(error):
+        # The request failed before after_request ran; don't leave a profiler running.
+        active = g.pop("profiler", None)
+        if active is not None:
+            active[1].stop()
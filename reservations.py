@@ -0,0 +1,163 @@
+import datetime
+
+from google.cloud import datastore
+
+import batching
+
+# For each kind with a unique property, the kind of its reservation entities.
+# A reservation is keyed by the property value (UserEmail:<email>) and holds
+# the id of the entity that owns it, so uniqueness checks and lookups by that
+# value are single key gets instead of queries.
+UNIQUE_PROPERTIES = {
+    "User": ("UserEmail", "email"),
+    "Item": ("ItemName", "name"),
+    "Store": ("StoreName", "name"),
+    "Tag": ("TagName", "name"),
+}
+
+
+class AlreadyReserved(Exception):
+    def __init__(self, kind, value, owner_id):
+        super().__init__(f"{kind} with {UNIQUE_PROPERTIES[kind][1]} {value!r} already exists")
+        self.kind = kind
+        self.value = value
+        self.owner_id = owner_id
+
+
+def reservation_key(client, kind, value):
+    return client.key(UNIQUE_PROPERTIES[kind][0], value)
+
+
+def unique_value(entity):
+    value = entity.get(UNIQUE_PROPERTIES[entity.key.kind][1])
+    return value if isinstance(value, str) and value else None
+
+
+def reservation_for(client, entity):
+    reservation = datastore.Entity(key=reservation_key(client, entity.key.kind, unique_value(entity)))
+    reservation.update({
+        "entity_id": entity.key.id,
+        "created": datetime.datetime.now(tz=datetime.timezone.utc)
+    })
+    return reservation
+
+
+def lookup_id(client, kind, value):
+    if not value:
+        return None
+    reservation = client.get(reservation_key(client, kind, value))
+    return reservation["entity_id"] if reservation else None
+
+
+def lookup_ids(client, kind, values):
+    values = [value for value in batching.unique(values) if value]
+    reservations = batching.get_multi(client, [reservation_key(client, kind, value) for value in values])
+    return {reservation.key.name: reservation["entity_id"] for reservation in reservations}
+
+
+def _check_free(client, kind, value, entity_id):
+    reservation = client.get(reservation_key(client, kind, value))
+    if reservation is not None and reservation["entity_id"] != entity_id:
+        # The owner may have been deleted without releasing its reservation.
+        if client.get(client.key(kind, reservation["entity_id"])) is not None:
+            raise AlreadyReserved(kind, value, reservation["entity_id"])
+
+
+# Creates the entity and its reservation in one transaction. Raises
+# AlreadyReserved if another entity holds the value.
+def insert(client, entity):
+    if entity.key.is_partial:
+        entity.key = client.allocate_ids(entity.key, 1)[0]
+    value = unique_value(entity)
+    with client.transaction():
+        if value is not None:
+            _check_free(client, entity.key.kind, value, entity.key.id)
+            client.put_multi([entity, reservation_for(client, entity)])
+        else:
+            client.put(entity)
+    return entity.key.id
+
+
+# Creates new entities of one kind, whose keys are already allocated, with
+# their reservations, one transaction per chunk. A value another entity holds
+# stays with that entity and the new one is not written. Returns
+# {value: id of the entity holding it}.
+def insert_many(client, entities):
+    owners = {}
+    for chunk in batching.chunked(list(entities), batching.PUT_MULTI_LIMIT // 2):
+        kind = chunk[0].key.kind
+        values = [unique_value(entity) for entity in chunk]
+        with client.transaction():
+            held = {reservation.key.name: reservation["entity_id"]
+                    for reservation in client.get_multi([reservation_key(client, kind, value) for value in values])}
+            # As in _check_free, a reservation whose owner was deleted is free.
+            live = {entity.key.id for entity in client.get_multi([client.key(kind, owner_id) for owner_id in set(held.values())])}
+            puts = []
+            for entity, value in zip(chunk, values):
+                if held.get(value) in live:
+                    owners[value] = held[value]
+                else:
+                    puts.extend([entity, reservation_for(client, entity)])
+                    owners[value] = entity.key.id
+            if puts:
+                client.put_multi(puts)
+    return owners
+
+
+# Saves an entity whose unique value may have changed from previous_value,
+# moving the reservation with it.
+def update(client, entity, previous_value):
+    kind = entity.key.kind
+    value = unique_value(entity)
+    with client.transaction():
+        if value == previous_value:
+            client.put(entity)
+            return entity
+        puts = [entity]
+        if value is not None:
+            _check_free(client, kind, value, entity.key.id)
+            puts.append(reservation_for(client, entity))
+        client.put_multi(puts)
+        if previous_value and lookup_id(client, kind, previous_value) == entity.key.id:
+            client.delete(reservation_key(client, kind, previous_value))
+    return entity
+
+
+def delete(client, entity):
+    kind = entity.key.kind
+    value = unique_value(entity)
+    with client.transaction():
+        client.delete(entity.key)
+        if value is not None and lookup_id(client, kind, value) == entity.key.id:
+            client.delete(reservation_key(client, kind, value))
+
+
+# Writes missing reservations for existing entities of one kind. When several
+# entities share a value the oldest keeps it; the rest are returned as
+# conflicts so they can be renamed by hand.
+def backfill(client, kind):
+    owners = {}
+    conflicts = []
+    query = client.query(kind=kind)
+    for entity in query.fetch():
+        value = unique_value(entity)
+        if value is None:
+            continue
+        current = owners.get(value)
+        if current is None:
+            owners[value] = entity
+            continue
+        older, newer = sorted((current, entity), key=lambda e: (e.get("timestamp") is None, e.get("timestamp") or 0, e.key.id))
+        owners[value] = older
+        conflicts.append((value, newer.key.id, older.key.id))
+
+    existing = lookup_ids(client, kind, list(owners))
+    missing = []
+    for value, entity in owners.items():
+        owner_id = existing.get(value)
+        if owner_id is None:
+            missing.append(reservation_for(client, entity))
+        elif owner_id != entity.key.id:
+            conflicts.append((value, entity.key.id, owner_id))
+    batching.put_multi(client, missing)
+    return len(missing), conflicts
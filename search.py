@@ -0,0 +1,329 @@
+import bisect
+import heapq
+import json
+import os
+import re
+import string
+import tempfile
+import threading
+import time
+import unicodedata
+
+FIELD_WEIGHTS = {"name": 3.0, "brand": 2.0, "tags": 1.0}
+# Query tokens that complete nothing are matched against terms sharing at
+# least this share of trigrams (Dice coefficient).
+FUZZY_THRESHOLD = 0.45
+FUZZY_WEIGHT = 0.6
+# Short words share few trigrams, so a single typo ("mlik") can leave none in
+# common. Terms one edit or swap away count as this similar, for tokens of at
+# least EDIT_MIN_LENGTH characters.
+EDIT_SIMILARITY = 0.75
+EDIT_MIN_LENGTH = 3
+EDIT_ALPHABET = string.ascii_lowercase + string.digits
+# A one- or two-letter prefix can complete thousands of terms; only the first
+# ones in term order are expanded so a keystroke stays cheap.
+MAX_PREFIX_TERMS = 256
+SNAPSHOT_VERSION = 1
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    if not isinstance(text, str):
+        return []
+    if text.isascii():
+        return _TOKEN.findall(text.lower())
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return _TOKEN.findall("".join(char for char in decomposed if not unicodedata.combining(char)))
+
+
+def trigrams(term):
+    padded = f" {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def single_edits(token):
+    # Every string one deletion, adjacent swap, substitution or insertion
+    # away (Damerau distance 1), over EDIT_ALPHABET.
+    splits = [(token[:i], token[i:]) for i in range(len(token) + 1)]
+    edits = set()
+    for left, right in splits:
+        if right:
+            edits.add(left + right[1:])
+            for char in EDIT_ALPHABET:
+                edits.add(left + char + right[1:])
+        if len(right) > 1:
+            edits.add(left + right[1] + right[0] + right[2:])
+        for char in EDIT_ALPHABET:
+            edits.add(left + char + right)
+    edits.discard(token)
+    return edits
+
+
+def _document_terms(name, brand, tags):
+    weights = {}
+    fields = (("name", [name]), ("brand", [brand]), ("tags", tags or []))
+    for field, values in fields:
+        for value in values:
+            for term in tokenize(value):
+                weights[term] = max(weights.get(term, 0.0), FIELD_WEIGHTS[field])
+    return weights
+
+
+# Inverted index from name, brand and tag terms to item ids. Each term keeps
+# its item ids sorted per field weight, so the best matches for one token are
+# read off the front of those lists. Terms are also kept sorted for prefix
+# lookups and indexed by trigram for fuzzy matches.
+class InvertedIndex:
+    def __init__(self):
+        self.documents = {}
+        self._postings = {}
+        self._ranked = {}
+        self._terms = []
+        self._trigrams = {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _add_term(self, term):
+        self._postings[term] = {}
+        self._ranked[term] = {}
+        bisect.insort(self._terms, term)
+        for gram in trigrams(term):
+            self._trigrams.setdefault(gram, set()).add(term)
+
+    def _drop_term(self, term):
+        del self._postings[term]
+        del self._ranked[term]
+        del self._terms[bisect.bisect_left(self._terms, term)]
+        for gram in trigrams(term):
+            terms = self._trigrams[gram]
+            terms.discard(term)
+            if not terms:
+                del self._trigrams[gram]
+
+    def add(self, item_id, name, brand, tags):
+        self.remove(item_id)
+        tags = [tag for tag in tags or [] if isinstance(tag, str)]
+        weights = _document_terms(name, brand, tags)
+        self.documents[item_id] = (name, brand, tags, tuple(weights))
+        for term, weight in weights.items():
+            if term not in self._postings:
+                self._add_term(term)
+            self._postings[term][item_id] = weight
+            bisect.insort(self._ranked[term].setdefault(weight, []), item_id)
+
+    # Bulk load: fills the postings directly and sorts each list once instead
+    # of inserting item by item.
+    @classmethod
+    def build(cls, rows):
+        index = cls()
+        postings = index._postings
+        for item_id, name, brand, tags in rows:
+            if item_id in index.documents:
+                continue
+            tags = [tag for tag in tags or [] if isinstance(tag, str)]
+            weights = _document_terms(name, brand, tags)
+            index.documents[item_id] = (name, brand, tags, tuple(weights))
+            for term, weight in weights.items():
+                postings.setdefault(term, {})[item_id] = weight
+        for term, term_postings in postings.items():
+            ranked = index._ranked[term] = {}
+            for item_id, weight in term_postings.items():
+                ranked.setdefault(weight, []).append(item_id)
+            for item_ids in ranked.values():
+                item_ids.sort()
+            for gram in trigrams(term):
+                index._trigrams.setdefault(gram, set()).add(term)
+        index._terms = sorted(postings)
+        return index
+
+    def remove(self, item_id):
+        document = self.documents.pop(item_id, None)
+        if document is None:
+            return
+        for term in document[3]:
+            weight = self._postings[term].pop(item_id)
+            ranked = self._ranked[term][weight]
+            del ranked[bisect.bisect_left(ranked, item_id)]
+            if not ranked:
+                del self._ranked[term][weight]
+            if not self._postings[term]:
+                self._drop_term(term)
+
+    def _completions(self, token):
+        start = bisect.bisect_left(self._terms, token)
+        end = min(bisect.bisect_left(self._terms, token + "\U0010ffff"), start + MAX_PREFIX_TERMS)
+        return self._terms[start:end]
+
+    def _similar_terms(self, token):
+        grams = trigrams(token)
+        shared = {}
+        for gram in grams:
+            for term in self._trigrams.get(gram, ()):
+                shared[term] = shared.get(term, 0) + 1
+        similar = {}
+        for term, count in shared.items():
+            score = 2 * count / (len(grams) + len(trigrams(term)))
+            if score >= FUZZY_THRESHOLD:
+                similar[term] = score
+        if len(token) >= EDIT_MIN_LENGTH:
+            for term in single_edits(token):
+                if term in self._postings:
+                    similar[term] = max(similar.get(term, 0.0), EDIT_SIMILARITY)
+        return list(similar.items())
+
+    def _matches(self, token):
+        # Exact terms score 1, completions less the more they add, and fuzzy
+        # matches only when nothing starts with the token.
+        matches = [(term, 1.0 if term == token else 0.5 + 0.5 * len(token) / len(term))
+                   for term in self._completions(token)]
+        if not matches:
+            matches = [(term, score * FUZZY_WEIGHT) for term, score in self._similar_terms(token)]
+        return matches
+
+    def _top_for_token(self, matches, limit):
+        # An item's score is its best (term, weight) list, so walking the
+        # lists from the highest score down finds the top items without
+        # scoring the rest.
+        levels = {}
+        for term, quality in matches:
+            for weight, item_ids in self._ranked[term].items():
+                levels.setdefault(quality * weight, []).append(item_ids)
+        best = []
+        seen = set()
+        for score in sorted(levels, reverse=True):
+            for item_id in heapq.merge(*levels[score]):
+                if item_id not in seen:
+                    seen.add(item_id)
+                    best.append((item_id, score))
+                    if len(best) == limit:
+                        return best
+        return best
+
+    def _scores(self, matches, candidates):
+        # Look each candidate up, or walk the postings, whichever touches fewer entries.
+        scores = dict.fromkeys(candidates, 0.0)
+        if len(candidates) * len(matches) <= sum(len(self._postings[term]) for term, _ in matches):
+            for term, quality in matches:
+                postings = self._postings[term]
+                for item_id in candidates:
+                    weight = postings.get(item_id)
+                    if weight is not None and quality * weight > scores[item_id]:
+                        scores[item_id] = quality * weight
+        else:
+            for term, quality in matches:
+                for item_id, weight in self._postings[term].items():
+                    if item_id in scores and quality * weight > scores[item_id]:
+                        scores[item_id] = quality * weight
+        return scores
+
+    def search(self, text, limit=20):
+        tokens = list(dict.fromkeys(tokenize(text)))
+        if not tokens:
+            return []
+        per_token = [self._matches(token) for token in tokens]
+        if len(per_token) == 1:
+            best = self._top_for_token(per_token[0], limit)
+        else:
+            # Every token has to match: intersect the id sets first, then
+            # score only the items left.
+            candidates = None
+            for matches in sorted(per_token, key=lambda matches: sum(len(self._postings[term]) for term, _ in matches)):
+                ids = set().union(*(self._postings[term].keys() for term, _ in matches))
+                candidates = ids if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+            totals = dict.fromkeys(candidates, 0.0)
+            for matches in per_token:
+                for item_id, score in self._scores(matches, candidates).items():
+                    totals[item_id] += score
+            best = heapq.nsmallest(limit, totals.items(), key=lambda entry: (-entry[1], entry[0]))
+        results = []
+        for item_id, score in best:
+            name, brand, tags, _ = self.documents[item_id]
+            results.append({"id": item_id, "name": name, "brand": brand, "tags": tags, "score": round(score, 3)})
+        return results
+
+
+# Item search kept current by the item write helpers. A full reload every
+# `ttl` seconds picks up writes made by other instances, and each reload is
+# written to `snapshot_path` so a new instance can start from the file
+# instead of scanning every item.
+class ItemSearch:
+    def __init__(self, load_items, snapshot_path=None, ttl=900):
+        self._load_items = load_items
+        self._snapshot_path = snapshot_path
+        self._ttl = ttl
+        self._index = InvertedIndex()
+        self._loaded_at = None
+        self._snapshot_checked = False
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self._ttl:
+            return
+        if not self._snapshot_checked:
+            self._snapshot_checked = True
+            if self._load_snapshot():
+                return
+        self._index = InvertedIndex.build(self._load_items())
+        self._loaded_at = time.monotonic()
+        self._save_snapshot()
+
+    def _load_snapshot(self):
+        if not self._snapshot_path:
+            return False
+        try:
+            with open(self._snapshot_path) as snapshot:
+                data = json.load(snapshot)
+        except (OSError, ValueError):
+            return False
+        age = time.time() - data.get("created", 0)
+        if data.get("version") != SNAPSHOT_VERSION or not 0 <= age < self._ttl:
+            return False
+        self._index = InvertedIndex.build(data["items"])
+        # The snapshot is as stale as it is old; reload when its ttl runs out.
+        self._loaded_at = time.monotonic() - age
+        return True
+
+    def _save_snapshot(self):
+        if not self._snapshot_path:
+            return
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "created": time.time(),
+            "items": [[item_id, name, brand, tags] for item_id, (name, brand, tags, _) in self._index.documents.items()],
+        }
+        directory = os.path.dirname(os.path.abspath(self._snapshot_path))
+        try:
+            # Written beside the target and renamed, so readers never see half a file.
+            fd, temporary = tempfile.mkstemp(dir=directory, prefix=".search-", suffix=".tmp")
+            with os.fdopen(fd, "w") as output:
+                json.dump(data, output, separators=(",", ":"))
+            os.replace(temporary, self._snapshot_path)
+        except OSError:
+            pass
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def upsert(self, item_id, name, brand, tags):
+        with self._lock:
+            if self._loaded_at is not None:
+                self._index.add(item_id, name, brand, tags)
+
+    def remove(self, item_id):
+        with self._lock:
+            self._index.remove(item_id)
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._index)
+
+    def search(self, text, limit=20):
+        with self._lock:
+            self._ensure_loaded()
+            return self._index.search(text, limit)
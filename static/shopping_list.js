@@ -23,7 +23,8 @@ document.addEventListener('DOMContentLoaded', function() {
             .then(response => response.json())
             .then(shoppingList => {
                 console.log('Fetched shopping list:', shoppingList); 
-                displayShoppingList(shoppingList);
+                displayShoppingList(shoppingList.items);
+                displayTotal(shoppingList.total);
             })
             .catch(error => console.error('Error fetching shopping list:', error));
     }
@@ -37,7 +38,8 @@ document.addEventListener('DOMContentLoaded', function() {
             if (data.error) {
                 console.error(data.error);
             } else {
-                data.forEach(item => {
+                displayTotal(data.total);
+                data.items.forEach(item => {
                     const itemElement = document.createElement("div");
                     itemElement.className = "shopping-list-item";
                     itemElement.innerHTML = `
@@ -58,6 +60,13 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
 
+    function displayTotal(total) {
+        const totalElement = document.getElementById('shoppingListTotal');
+        if (totalElement) {
+            totalElement.textContent = `Total: ${total}`;
+        }
+    }
+
     function displayShoppingList(shoppingList) {
         const shoppingListDiv = document.getElementById('shoppingList');
         if (shoppingListDiv) {
@@ -19,19 +19,37 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
 
-    function fetchStores() {
-        fetch('/api/stores')
+    function fetchStores(cursor) {
+        const url = cursor ? `/api/stores?cursor=${encodeURIComponent(cursor)}` : '/api/stores';
+        fetch(url)
             .then(response => response.json())
-            .then(stores => {
-                displayStores(stores);
+            .then(data => {
+                displayStores(data.stores, !cursor);
+                if (data.next_cursor) {
+                    addLoadMoreStoresButton(data.next_cursor);
+                }
             })
             .catch(error => console.error('Error fetching stores:', error));
     }
 
-    function displayStores(stores) {
+    function addLoadMoreStoresButton(cursor) {
+        const storeList = document.getElementById('storeList');
+        const loadMoreButton = document.createElement('button');
+        loadMoreButton.className = 'load-more-btn';
+        loadMoreButton.textContent = 'Load More Stores';
+        loadMoreButton.addEventListener('click', function() {
+            loadMoreButton.remove();
+            fetchStores(cursor);
+        });
+        storeList.appendChild(loadMoreButton);
+    }
+
+    function displayStores(stores, replace) {
         const storeList = document.getElementById('storeList');
         if (storeList) {
-            storeList.innerHTML = '';
+            if (replace) {
+                storeList.innerHTML = '';
+            }
             stores.forEach(store => {
                 const storeDiv = document.createElement('div');
                 storeDiv.className = 'store-item';
@@ -44,7 +62,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 storeList.appendChild(storeDiv);
             });
 
-            document.querySelectorAll('.view-items-btn').forEach(button => {
+            storeList.querySelectorAll('.view-items-btn:not([data-bound])').forEach(button => {
+                button.dataset.bound = 'true';
                 button.addEventListener('click', function() {
                     const storeId = this.parentElement.dataset.storeId;
                     fetchItemsByStore(storeId);
@@ -55,19 +74,39 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    function fetchItemsByStore(storeId) {
-        fetch(`/api/store/${storeId}/items`)
+    function fetchItemsByStore(storeId, cursor) {
+        const url = cursor
+            ? `/api/store/${storeId}/items?cursor=${encodeURIComponent(cursor)}`
+            : `/api/store/${storeId}/items`;
+        fetch(url)
             .then(response => response.json())
-            .then(items => {
-                displayItems(items);
+            .then(data => {
+                displayItems(data.items, !cursor);
+                if (data.next_cursor) {
+                    addLoadMoreButton(storeId, data.next_cursor);
+                }
             })
             .catch(error => console.error('Error fetching items:', error));
     }
 
-    function displayItems(items) {
+    function addLoadMoreButton(storeId, cursor) {
+        const itemList = document.getElementById('itemList');
+        const loadMoreButton = document.createElement('button');
+        loadMoreButton.className = 'load-more-btn';
+        loadMoreButton.textContent = 'Load More Items';
+        loadMoreButton.addEventListener('click', function() {
+            loadMoreButton.remove();
+            fetchItemsByStore(storeId, cursor);
+        });
+        itemList.appendChild(loadMoreButton);
+    }
+
+    function displayItems(items, replace) {
         const itemList = document.getElementById('itemList');
         if (itemList) {
-            itemList.innerHTML = '';
+            if (replace) {
+                itemList.innerHTML = '';
+            }
             items.forEach(item => {
                 const itemDiv = document.createElement('div');
                 itemDiv.className = 'item';
@@ -82,7 +121,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 itemList.appendChild(itemDiv);
             });
 
-            document.querySelectorAll('.add-to-cart-btn').forEach(button => {
+            itemList.querySelectorAll('.add-to-cart-btn:not([data-bound])').forEach(button => {
+                button.dataset.bound = 'true';
                 button.addEventListener('click', function() {
                     const itemId = this.parentElement.dataset.itemId;
                     console.log('Adding item to shopping list:', itemId);
@@ -147,7 +187,7 @@ document.addEventListener('DOMContentLoaded', function() {
         fetch(`/api/shoppinglist/${userId}`)
             .then(response => response.json())
             .then(shoppingList => {
-                displayShoppingList(shoppingList);
+                displayShoppingList(shoppingList.items);
             })
             .catch(error => console.error('Error updating shopping list:', error));
     }
@@ -0,0 +1,501 @@
+import base64
+import copy
+import datetime
+import functools
+import itertools
+import json
+import os
+import pickle
+import sqlite3
+import threading
+
+from google.cloud import datastore
+
+BACKEND_ENV = "STORAGE_BACKEND"
+SQLITE_PATH_ENV = "STORAGE_SQLITE_PATH"
+DEFAULT_SQLITE_PATH = "storage.sqlite3"
+LOCAL_PROJECT = "local"
+
+# Properties the app filters on. The local backends keep an index for each
+# so equality and IN queries on them don't scan the whole kind.
+INDEXED_PROPERTIES = ("item_id", "store_id", "user_id", "tag_id", "email", "name", "barcode")
+
+
+# Picks the storage client from STORAGE_BACKEND: "datastore" (default) talks
+# to Cloud Datastore, "memory" and "sqlite" run the app without it.
+def create_client(backend=None):
+    backend = backend or os.environ.get(BACKEND_ENV, "datastore")
+    if backend == "datastore":
+        return datastore.Client()
+    if backend == "memory":
+        return MemoryClient()
+    if backend == "sqlite":
+        return SQLiteClient(os.environ.get(SQLITE_PATH_ENV, DEFAULT_SQLITE_PATH))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+# Maps a property value to something that sorts the way Datastore orders
+# values of mixed types, and that survives a JSON round trip for cursors.
+def _order_value(value):
+    if value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (2, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, datetime.datetime):
+        return (3, value.timestamp())
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, bytes):
+        return (5, value.hex())
+    if isinstance(value, datastore.Key):
+        return (6, tuple((0, part) if isinstance(part, int) else (1, part) for part in value.flat_path))
+    return (7, repr(value))
+
+
+def _tuples(value):
+    if isinstance(value, list):
+        return tuple(_tuples(item) for item in value)
+    return value
+
+
+def _values(entity, name):
+    if name == "__key__":
+        return [entity.key]
+    if name not in entity:
+        return None
+    value = entity[name]
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _matches(entity, filters):
+    for name, operator, expected in filters:
+        values = _values(entity, name)
+        if not values:
+            return False
+        if operator in ("IN", "NOT_IN"):
+            wanted = {_order_value(item) for item in expected}
+            found = any(_order_value(value) in wanted for value in values)
+            if found != (operator == "IN"):
+                return False
+            continue
+        target = _order_value(expected)
+        compare = {
+            "=": lambda v: v == target,
+            "!=": lambda v: v != target,
+            "<": lambda v: v < target,
+            "<=": lambda v: v <= target,
+            ">": lambda v: v > target,
+            ">=": lambda v: v >= target,
+        }.get(operator)
+        if compare is None:
+            raise ValueError(f"Unsupported filter operator: {operator}")
+        if not any(compare(_order_value(value)) for value in values):
+            return False
+    return True
+
+
+def _sort_key(entity, order):
+    key = []
+    for name in order:
+        descending = name.startswith("-")
+        values = [_order_value(value) for value in _values(entity, name.lstrip("-"))]
+        key.append(max(values) if descending else min(values))
+    return key
+
+
+def _compare_keys(left, right, order):
+    for name, a, b in zip(order, left, right):
+        if a != b:
+            result = -1 if a < b else 1
+            return -result if name.startswith("-") else result
+    return 0
+
+
+def _encode_cursor(sort_key):
+    return base64.urlsafe_b64encode(json.dumps(sort_key).encode("utf-8"))
+
+
+def _decode_cursor(cursor):
+    if isinstance(cursor, str):
+        cursor = cursor.encode("ascii")
+    try:
+        return list(_tuples(json.loads(base64.urlsafe_b64decode(cursor))))
+    except ValueError as error:
+        raise ValueError("Invalid query cursor") from error
+
+
+def _copy_entity(entity, properties=None):
+    copied = datastore.Entity(key=entity.key, exclude_from_indexes=tuple(entity.exclude_from_indexes))
+    for name, value in entity.items():
+        if properties is None or name in properties:
+            copied[name] = copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+    return copied
+
+
+def _indexed_values(entity, name):
+    values = _values(entity, name) or []
+    return [value for value in values if isinstance(value, (str, int, float)) and not isinstance(value, bool)]
+
+
+def _pushdown_filters(filters):
+    # Equality and IN filters on indexed properties, as (name, values) pairs.
+    pushed = []
+    for name, operator, expected in filters:
+        if name not in INDEXED_PROPERTIES or operator not in ("=", "IN"):
+            continue
+        values = list(expected) if operator == "IN" else [expected]
+        if all(isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in values):
+            pushed.append((name, values))
+    return pushed
+
+
+class LocalQuery:
+    def __init__(self, client, kind=None):
+        self._client = client
+        self.kind = kind
+        self.filters = []
+        self.order = []
+        self.projection = []
+
+    def add_filter(self, property_name, operator, value):
+        self.filters.append((property_name, operator, value))
+        return self
+
+    def keys_only(self):
+        self.projection = ["__key__"]
+
+    def fetch(self, limit=None, offset=0, start_cursor=None):
+        return LocalIterator(self, limit, offset, start_cursor)
+
+
+# Runs the query when created and serves the results as a single page. Like
+# Datastore's iterator, next_page_token is a cursor positioned after the last
+# returned entity, or None once there are no more results.
+class LocalIterator:
+    def __init__(self, query, limit=None, offset=0, start_cursor=None):
+        entities, self.next_page_token = query._client._run_query(query, limit, offset, start_cursor)
+        self._page = entities
+
+    def __iter__(self):
+        return iter(self._page)
+
+    @property
+    def pages(self):
+        yield iter(self._page)
+
+
+# Buffers puts and deletes until the with block exits, then applies them in
+# one write. Transactions on a client run one at a time.
+class LocalTransaction:
+    def __init__(self, client):
+        self._client = client
+        self._puts = []
+        self._deletes = []
+
+    def begin(self):
+        self._client._transaction_lock.acquire()
+        self._client._local.transactions = getattr(self._client._local, "transactions", []) + [self]
+
+    def put(self, entity):
+        self._puts.append(entity)
+
+    def put_multi(self, entities):
+        self._puts.extend(entities)
+
+    def delete(self, key):
+        self._deletes.append(key)
+
+    def delete_multi(self, keys):
+        self._deletes.extend(keys)
+
+    def _end(self):
+        self._client._local.transactions = self._client._local.transactions[:-1]
+        self._client._transaction_lock.release()
+
+    def commit(self):
+        try:
+            self._client._apply(self._puts, self._deletes)
+        finally:
+            self._end()
+
+    def rollback(self):
+        self._puts = []
+        self._deletes = []
+        self._end()
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+# The subset of datastore.Client the app uses, over local storage. Subclasses
+# provide _load, _store, _remove and _scan; keys and entities are the real
+# google.cloud.datastore types so app code can't tell the backends apart.
+class _LocalClient:
+    project = LOCAL_PROJECT
+    namespace = None
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._transaction_lock = threading.RLock()
+        self._local = threading.local()
+
+    def _transaction(self):
+        transactions = getattr(self._local, "transactions", None)
+        return transactions[-1] if transactions else None
+
+    def key(self, *path_args, **kwargs):
+        kwargs.setdefault("project", self.project)
+        return datastore.Key(*path_args, **kwargs)
+
+    def query(self, kind=None, **kwargs):
+        query = LocalQuery(self, kind)
+        for name, operator, value in kwargs.get("filters", ()):
+            query.add_filter(name, operator, value)
+        query.order = list(kwargs.get("order", ()))
+        return query
+
+    def transaction(self, **kwargs):
+        return LocalTransaction(self)
+
+    def allocate_ids(self, incomplete_key, num_ids):
+        return [incomplete_key.completed_key(allocated) for allocated in self._allocate(num_ids)]
+
+    def get(self, key, missing=None):
+        entities = self.get_multi([key], missing=missing)
+        return entities[0] if entities else None
+
+    def get_multi(self, keys, missing=None):
+        with self._lock:
+            entities = self._load(keys)
+        found = []
+        for key, entity in zip(keys, entities):
+            if entity is None:
+                if missing is not None:
+                    missing.append(datastore.Entity(key=key))
+            else:
+                found.append(entity)
+        return found
+
+    def put(self, entity):
+        self.put_multi([entity])
+
+    def put_multi(self, entities):
+        transaction = self._transaction()
+        if transaction is not None:
+            transaction.put_multi(entities)
+        else:
+            self._apply(entities, [])
+
+    def delete(self, key):
+        self.delete_multi([key])
+
+    def delete_multi(self, keys):
+        transaction = self._transaction()
+        if transaction is not None:
+            transaction.delete_multi(keys)
+        else:
+            self._apply([], keys)
+
+    def _apply(self, puts, deletes):
+        with self._lock:
+            partial = [entity for entity in puts if entity.key.is_partial]
+            for entity, allocated in zip(partial, self._allocate(len(partial))):
+                entity.key = entity.key.completed_key(allocated)
+            self._write([_copy_entity(entity) for entity in puts], deletes)
+
+    def _run_query(self, query, limit, offset, start_cursor):
+        if query.kind is None:
+            raise ValueError("Kindless queries are not supported")
+        order = [name for name in query.order if name.lstrip("-") != "__key__"]
+        order.append(next((name for name in query.order if name.lstrip("-") == "__key__"), "__key__"))
+        with self._lock:
+            candidates = self._scan(query.kind, query.filters)
+
+        rows = []
+        for entity in candidates:
+            if not _matches(entity, query.filters):
+                continue
+            # Like Datastore, an entity without an ordered property is left out.
+            if any(not _values(entity, name.lstrip("-")) for name in order):
+                continue
+            rows.append((_sort_key(entity, order), entity))
+        rows.sort(key=functools.cmp_to_key(lambda a, b: _compare_keys(a[0], b[0], order)))
+
+        if start_cursor:
+            after = _decode_cursor(start_cursor)
+            rows = [row for row in rows if _compare_keys(row[0], after, order) > 0]
+        rows = rows[offset or 0:]
+        page = rows if limit is None else rows[:limit]
+        next_page_token = None
+        if page and len(page) < len(rows):
+            next_page_token = _encode_cursor(page[-1][0])
+
+        projection = [name for name in query.projection if name != "__key__"]
+        if query.projection:
+            entities = [_copy_entity(entity, projection) for _, entity in page]
+        else:
+            entities = [_copy_entity(entity) for _, entity in page]
+        return entities, next_page_token
+
+
+class MemoryClient(_LocalClient):
+    def __init__(self):
+        super().__init__()
+        self._entities = {}
+        self._kinds = {}
+        self._indexes = {}
+        self._ids = itertools.count(1)
+
+    def _allocate(self, count):
+        with self._lock:
+            return [next(self._ids) for _ in range(count)]
+
+    def _index_entries(self, entity):
+        for name in INDEXED_PROPERTIES:
+            for value in _indexed_values(entity, name):
+                yield (entity.key.kind, name), _order_value(value)
+
+    def _unindex(self, path):
+        entity = self._entities.pop(path, None)
+        if entity is None:
+            return
+        self._kinds[entity.key.kind].pop(path, None)
+        for index, value in self._index_entries(entity):
+            self._indexes[index][value].discard(path)
+
+    def _load(self, keys):
+        entities = []
+        for key in keys:
+            entity = self._entities.get(key.flat_path)
+            entities.append(_copy_entity(entity) if entity is not None else None)
+        return entities
+
+    def _write(self, puts, deletes):
+        for key in deletes:
+            self._unindex(key.flat_path)
+        for entity in puts:
+            path = entity.key.flat_path
+            self._unindex(path)
+            self._entities[path] = entity
+            self._kinds.setdefault(entity.key.kind, {})[path] = entity
+            for index, value in self._index_entries(entity):
+                self._indexes.setdefault(index, {}).setdefault(value, set()).add(path)
+
+    def _scan(self, kind, filters):
+        paths = None
+        for name, values in _pushdown_filters(filters):
+            index = self._indexes.get((kind, name), {})
+            matched = set()
+            for value in values:
+                matched |= index.get(_order_value(value), set())
+            paths = matched if paths is None else paths & matched
+        entities = self._kinds.get(kind, {})
+        if paths is None:
+            return list(entities.values())
+        return [entities[path] for path in paths]
+
+
+# Entities are pickled into one table; values of the indexed properties are
+# copied into a second table with a partial index per property, so filters
+# on them become index lookups. Everything else is filtered in Python.
+class SQLiteClient(_LocalClient):
+    def __init__(self, path=":memory:"):
+        super().__init__()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entities (path TEXT PRIMARY KEY, kind TEXT NOT NULL, entity BLOB NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS entities_kind ON entities (kind)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS properties (path TEXT NOT NULL, kind TEXT NOT NULL, name TEXT NOT NULL, value)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS properties_path ON properties (path)")
+            for name in INDEXED_PROPERTIES:
+                self._connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS properties_{name} ON properties (kind, value) WHERE name = '{name}'")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._connection.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('id', 0)")
+
+    def close(self):
+        self._connection.close()
+
+    def _allocate(self, count):
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE counters SET value = value + ? WHERE name = 'id'", (count,))
+            (last,) = self._connection.execute("SELECT value FROM counters WHERE name = 'id'").fetchone()
+        return list(range(last - count + 1, last + 1))
+
+    def _path(self, key):
+        return json.dumps(key.flat_path)
+
+    def _decode(self, path, blob):
+        properties, exclude_from_indexes = pickle.loads(blob)
+        entity = datastore.Entity(key=self.key(*json.loads(path)), exclude_from_indexes=exclude_from_indexes)
+        entity.update(properties)
+        return entity
+
+    def _load(self, keys):
+        paths = [self._path(key) for key in keys]
+        found = {}
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self._connection.execute(
+                f"SELECT path, entity FROM entities WHERE path IN ({placeholders})", chunk)
+            for path, blob in rows:
+                found[path] = self._decode(path, blob)
+        return [found.get(path) for path in paths]
+
+    def _write(self, puts, deletes):
+        with self._connection:
+            for key in deletes:
+                path = self._path(key)
+                self._connection.execute("DELETE FROM entities WHERE path = ?", (path,))
+                self._connection.execute("DELETE FROM properties WHERE path = ?", (path,))
+            for entity in puts:
+                path = self._path(entity.key)
+                blob = pickle.dumps((dict(entity), tuple(entity.exclude_from_indexes)))
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO entities (path, kind, entity) VALUES (?, ?, ?)", (path, entity.key.kind, blob))
+                self._connection.execute("DELETE FROM properties WHERE path = ?", (path,))
+                self._connection.executemany(
+                    "INSERT INTO properties (path, kind, name, value) VALUES (?, ?, ?, ?)",
+                    [(path, entity.key.kind, name, value)
+                     for name in INDEXED_PROPERTIES for value in _indexed_values(entity, name)])
+
+    def _select(self, kind, filters):
+        pushed = _pushdown_filters(filters)
+        if not pushed:
+            return "SELECT path, entity FROM entities WHERE kind = ?", [kind]
+        # Drive the lookup from the first indexed filter; any others narrow it.
+        name, values = pushed[0]
+        sql = (f"SELECT DISTINCT e.path, e.entity FROM properties p JOIN entities e ON e.path = p.path"
+               f" WHERE p.name = '{name}' AND p.kind = ? AND p.value IN ({', '.join('?' * len(values))})")
+        params = [kind] + values
+        for name, values in pushed[1:]:
+            sql += (f" AND e.path IN (SELECT path FROM properties"
+                    f" WHERE name = '{name}' AND kind = ? AND value IN ({', '.join('?' * len(values))}))")
+            params += [kind] + values
+        return sql, params
+
+    def _scan(self, kind, filters):
+        sql, params = self._select(kind, filters)
+        return [self._decode(path, blob) for path, blob in self._connection.execute(sql, params)]
+
+    # SQLite's plan for the candidate lookup behind a query, for comparing
+    # how filters are served against the indexes.
+    def explain(self, query):
+        sql, params = self._select(query.kind, query.filters)
+        with self._lock:
+            return [row[-1] for row in self._connection.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
@@ -0,0 +1,217 @@
+import heapq
+
+from google.cloud import datastore
+
+import batching
+import reservations
+
+# One ItemTag entity per (tag, item) pair, keyed "<tag_id>:<item_id>", so a
+# tag's items are an index scan on (tag_id, item_id) and adding the same tag
+# twice writes the same key.
+KIND = "ItemTag"
+# Item ids read per query while walking a tag's postings.
+CHUNK_SIZE = 500
+
+
+def membership_key(client, tag_id, item_id):
+    return client.key(KIND, f"{tag_id}:{item_id}")
+
+
+def membership(client, tag_id, item_id):
+    entity = datastore.Entity(key=membership_key(client, tag_id, item_id))
+    entity.update({"tag_id": tag_id, "item_id": item_id})
+    return entity
+
+
+def _item_id(key):
+    return int(key.name.rpartition(":")[2])
+
+
+def _get_multi(reader, keys):
+    found = []
+    for chunk in batching.chunked(keys, batching.GET_MULTI_LIMIT):
+        found.extend(reader.get_multi(chunk))
+    return found
+
+
+# Items store tags as names (scans) or as Tag ids (tag endpoints). Maps each
+# value to the id of an existing Tag; unknown values are left out. `reader`
+# may be a unit of work so tags created earlier in the request are found.
+def resolve(client, values, reader=None):
+    reader = reader or client
+    values = batching.unique(value for value in values if isinstance(value, (int, str)) and not isinstance(value, bool))
+    tag_ids = {}
+    ids = [value for value in values if isinstance(value, int)]
+    if ids:
+        found = {tag.key.id for tag in _get_multi(reader, [client.key("Tag", tag_id) for tag_id in ids])}
+        tag_ids.update((tag_id, tag_id) for tag_id in ids if tag_id in found)
+    names = [value for value in values if isinstance(value, str)]
+    if names:
+        reservation_keys = [reservations.reservation_key(client, "Tag", name) for name in names if name]
+        for reservation in _get_multi(reader, reservation_keys):
+            tag_ids[reservation.key.name] = reservation["entity_id"]
+    return tag_ids
+
+
+# Maps the Tag ids among `values` to their names, for readers such as search
+# that need the text of every tag an item carries.
+def names(client, values, reader=None):
+    reader = reader or client
+    ids = batching.unique(value for value in values if isinstance(value, int) and not isinstance(value, bool))
+    tags = _get_multi(reader, [client.key("Tag", tag_id) for tag_id in ids])
+    return {tag.key.id: tag["name"] for tag in tags if isinstance(tag.get("name"), str)}
+
+
+def add_tags(client, writer, item, values, resolved=None):
+    # Appends the values whose tag the item doesn't carry yet, under either
+    # form, and writes their memberships. Returns whether the item changed.
+    # Callers tagging many items pass `resolved` from one resolve() call.
+    values = [value for value in batching.unique(values) if value is not None]
+    if resolved is None:
+        resolved = resolve(client, list(item.get("tags") or []) + values, writer)
+    tags = list(item.get("tags") or [])
+    present = {resolved.get(value, value) for value in tags}
+    added = []
+    for value in values:
+        if resolved.get(value, value) not in present:
+            present.add(resolved.get(value, value))
+            added.append(value)
+    if not added:
+        return False
+    item["tags"] = tags + added
+    memberships = [membership(client, resolved[value], item.key.id) for value in added if value in resolved]
+    if memberships:
+        writer.put_multi(memberships)
+    return True
+
+
+def sync(client, writer, item_id, old_values, new_values):
+    # Moves the memberships of an item whose tag list changed from
+    # old_values to new_values.
+    resolved = resolve(client, list(old_values or []) + list(new_values or []), writer)
+    old_ids = {resolved[value] for value in old_values or [] if value in resolved}
+    new_ids = {resolved[value] for value in new_values or [] if value in resolved}
+    if old_ids - new_ids:
+        writer.delete_multi([membership_key(client, tag_id, item_id) for tag_id in old_ids - new_ids])
+    if new_ids - old_ids:
+        writer.put_multi([membership(client, tag_id, item_id) for tag_id in new_ids - old_ids])
+
+
+# The item ids of one tag in ascending order, read CHUNK_SIZE at a time with
+# keys-only queries.
+class _Postings:
+    def __init__(self, client, tag_id, start):
+        self._client = client
+        self.tag_id = tag_id
+        self._ids = []
+        self._position = 0
+        self._fetch(start)
+
+    def _fetch(self, start):
+        query = self._client.query(kind=KIND)
+        query.add_filter("tag_id", "=", self.tag_id)
+        query.add_filter("item_id", ">=", start)
+        query.order = ["item_id"]
+        query.keys_only()
+        self._ids = [_item_id(entity.key) for entity in query.fetch(limit=CHUNK_SIZE)]
+        self._position = 0
+        self.exhausted = len(self._ids) < CHUNK_SIZE
+
+    def sparseness(self):
+        # Sorts the list with the fewest ids per id range first.
+        if self.exhausted:
+            return (0, len(self._ids))
+        return (1, -self._ids[-1])
+
+    def head(self):
+        if self._position < len(self._ids):
+            return self._ids[self._position]
+        if self.exhausted:
+            return None
+        self._fetch(self._ids[-1] + 1)
+        return self.head()
+
+    def next(self):
+        self._position += 1
+        return self.head()
+
+    def take_chunk(self):
+        if self.head() is None:
+            return []
+        chunk = self._ids[self._position:]
+        self._position = len(self._ids)
+        return chunk
+
+
+def _start(after):
+    return 0 if after is None else int(after) + 1
+
+
+# Items carrying every tag, in item id order after `after`. The sparsest
+# tag's ids are read a chunk at a time and the other tags are checked with
+# one key lookup per chunk, so a rare tag ANDed with a common one reads
+# little of the common one. Returns up to `limit` ids and the cursor for the
+# next page.
+def items_with_all(client, tag_ids, limit, after=None):
+    postings = sorted((_Postings(client, tag_id, _start(after)) for tag_id in batching.unique(tag_ids)),
+                      key=lambda p: p.sparseness())
+    driver, others = postings[0], postings[1:]
+    found = []
+    while len(found) <= limit:
+        chunk = driver.take_chunk()
+        if not chunk:
+            break
+        for other in others:
+            keys = [membership_key(client, other.tag_id, item_id) for item_id in chunk]
+            present = {_item_id(entity.key) for entity in batching.get_multi(client, keys)}
+            chunk = [item_id for item_id in chunk if item_id in present]
+        found.extend(chunk)
+    return _page(found, limit)
+
+
+# Items carrying any of the tags, in item id order after `after`.
+def items_with_any(client, tag_ids, limit, after=None):
+    postings = [_Postings(client, tag_id, _start(after)) for tag_id in batching.unique(tag_ids)]
+    heap = [(p.head(), index) for index, p in enumerate(postings) if p.head() is not None]
+    heapq.heapify(heap)
+    found = []
+    while heap and len(found) <= limit:
+        item_id, index = heapq.heappop(heap)
+        if not found or found[-1] != item_id:
+            found.append(item_id)
+        following = postings[index].next()
+        if following is not None:
+            heapq.heappush(heap, (following, index))
+    return _page(found, limit)
+
+
+def _page(found, limit):
+    if len(found) > limit:
+        return found[:limit], str(found[limit - 1])
+    return found, None
+
+
+# Writes the memberships of items tagged before the index existed. Safe to
+# re-run: memberships are keyed by (tag, item).
+def backfill(client):
+    written = 0
+    query = client.query(kind="Item")
+    pending = []
+    for item in query.fetch():
+        pending.append(item)
+        if len(pending) >= CHUNK_SIZE:
+            written += _backfill_items(client, pending)
+            pending = []
+    return written + _backfill_items(client, pending)
+
+
+def _backfill_items(client, items):
+    resolved = resolve(client, [value for item in items for value in item.get("tags") or []])
+    memberships = {}
+    for item in items:
+        for value in item.get("tags") or []:
+            if value in resolved:
+                entity = membership(client, resolved[value], item.key.id)
+                memberships[entity.key.name] = entity
+    batching.put_multi(client, memberships.values())
+    return len(memberships)
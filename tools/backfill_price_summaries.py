@@ -0,0 +1,18 @@
+"""Rebuild every PriceSummary and PriceHistory entity from the full Price history.
+
+Run once after deploying the PriceSummary or PriceHistory aggregates, or
+whenever they are suspected to have drifted:
+
+    python tools/backfill_price_summaries.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+if __name__ == "__main__":
+    count = main.rebuild_price_summaries()
+    print(f"Rebuilt {count} price summaries")
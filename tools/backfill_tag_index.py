@@ -0,0 +1,20 @@
+"""Write the ItemTag memberships behind /tags/<tag_id>/items for items tagged
+before the index existed.
+
+Safe to re-run: memberships are keyed by tag and item, so existing ones are
+rewritten unchanged. Tag values on an item that match no Tag are skipped.
+
+    python tools/backfill_tag_index.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+import tagging  # noqa: E402
+
+
+if __name__ == "__main__":
+    written = tagging.backfill(main.datastore_client)
+    print(f"{tagging.KIND}: wrote {written} memberships")
@@ -0,0 +1,24 @@
+"""Write the unique-key reservations (UserEmail, ItemName, StoreName, TagName)
+for entities created before reservations existed.
+
+Safe to re-run: existing reservations are left alone. Values held by more than
+one entity are reported; the oldest entity keeps the value and the others
+should be renamed.
+
+    python tools/backfill_unique_keys.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+import reservations  # noqa: E402
+
+
+if __name__ == "__main__":
+    for kind, (reservation_kind, property_name) in reservations.UNIQUE_PROPERTIES.items():
+        written, conflicts = reservations.backfill(main.datastore_client, kind)
+        print(f"{reservation_kind}: wrote {written} reservations")
+        for value, entity_id, owner_id in conflicts:
+            print(f"  duplicate {property_name} {value!r}: {kind} {entity_id} conflicts with {owner_id}")
@@ -0,0 +1,92 @@
+import batching
+
+# Firestore in Datastore mode accepts up to 500 mutations per transaction.
+TRANSACTION_LIMIT = 500
+
+
+# Collects the puts and deletes made while handling one request and commits
+# them together. Repeated writes to the same key collapse into the last one,
+# and reads through get/get_multi see the pending writes.
+class UnitOfWork:
+    def __init__(self, client):
+        self._client = client
+        self._puts = {}
+        self._deletes = {}
+        self._after_flush = []
+
+    def _identity(self, key):
+        if key.is_partial:
+            return None
+        return key.flat_path
+
+    def __len__(self):
+        return len(self._puts) + len(self._deletes)
+
+    def put(self, entity):
+        identity = self._identity(entity.key)
+        if identity is None:
+            identity = ("partial", id(entity))
+        self._deletes.pop(identity, None)
+        self._puts[identity] = entity
+
+    def put_multi(self, entities):
+        for entity in entities:
+            self.put(entity)
+
+    def delete(self, key):
+        identity = self._identity(key)
+        self._puts.pop(identity, None)
+        self._deletes[identity] = key
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    def get(self, key):
+        found = self.get_multi([key])
+        return found[0] if found else None
+
+    def get_multi(self, keys):
+        found = []
+        missing = []
+        for key in keys:
+            identity = self._identity(key)
+            if identity in self._puts:
+                found.append(self._puts[identity])
+            elif identity not in self._deletes:
+                missing.append(key)
+        if missing:
+            found.extend(batching.get_multi(self._client, missing))
+        return found
+
+    def after_flush(self, callback):
+        self._after_flush.append(callback)
+
+    def flush(self):
+        puts = list(self._puts.values())
+        deletes = list(self._deletes.values())
+        callbacks = self._after_flush
+        self._puts = {}
+        self._deletes = {}
+        self._after_flush = []
+
+        if len(puts) + len(deletes) <= TRANSACTION_LIMIT:
+            if puts or deletes:
+                with self._client.transaction():
+                    if puts:
+                        self._client.put_multi(puts)
+                    if deletes:
+                        self._client.delete_multi(deletes)
+        else:
+            # Too many mutations for one transaction; commit in batches instead.
+            batching.put_multi(self._client, puts)
+            for chunk in batching.chunked(deletes, batching.PUT_MULTI_LIMIT):
+                self._client.delete_multi(chunk)
+
+        for callback in callbacks:
+            callback()
+
+    def discard(self):
+        self._puts = {}
+        self._deletes = {}
+        self._after_flush = []
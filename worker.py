@@ -0,0 +1,31 @@
+"""Standalone background job worker.
+
+Runs the same job handlers as the web app against the shared Job queue,
+so fan-out work can be moved off the serving instances:
+
+    python worker.py --threads 4
+
+Set JOB_WORKERS=0 on the web app to leave all job processing to workers.
+The worker runs --threads threads whatever JOB_WORKERS says.
+"""
+import argparse
+import logging
+import os
+
+# Keeps main from starting its own job threads on import.
+os.environ["JOB_WORKERS"] = "0"
+
+import main  # noqa: E402
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background jobs from the Job queue.")
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    main.job_runner.start(args.threads)
+    try:
+        main.job_runner.join()
+    except KeyboardInterrupt:
+        main.job_runner.stop()
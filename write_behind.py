@@ -0,0 +1,186 @@
+import atexit
+import collections
+import copy
+import logging
+import threading
+import time
+
+import batching
+import metrics
+
+OVERFLOW_POLICIES = ("block", "drop", "write")
+# Ids are reserved this many at a time, so queued entities get their id
+# without a round trip each.
+ID_BLOCK = 100
+WRITE_ATTEMPTS = 3
+RETRY_DELAY = 0.5
+# Longest flush() waits for batches other threads are writing.
+FLUSH_TIMEOUT = 2.0
+
+logger = logging.getLogger(__name__)
+
+
+# Raised by callers that need queued writes on disk and got False from flush().
+class NotFlushed(Exception):
+    pass
+
+
+def _record(entities, outcome):
+    for kind, count in collections.Counter(entity.key.kind for entity in entities).items():
+        metrics.record_buffered(kind, outcome, count)
+
+
+# Queues writes nobody waits for and commits them from a background thread in
+# put_multi batches, once batch_size entities are queued or the oldest has
+# waited flush_interval seconds. When max_entries are queued, `overflow`
+# decides what a new write does: "block" waits up to block_timeout for room
+# and then writes it directly, "drop" discards it, "write" writes it
+# directly. A max_entries of 0 writes everything directly. Queued writes are
+# flushed when the process exits.
+class WriteBehindBuffer:
+    def __init__(self, client, max_entries=5000, batch_size=batching.PUT_MULTI_LIMIT, flush_interval=1.0,
+                 overflow="block", block_timeout=5.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.client = client
+        self.max_entries = max_entries
+        self.batch_size = min(batch_size, batching.PUT_MULTI_LIMIT)
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue = collections.deque()
+        # Batches being written, by number, so flush() can wait for the ones
+        # taken before it was called and get() can still find their entities.
+        self._writing = {}
+        self._batches = 0
+        self._closed = False
+        self._thread = None
+        self._condition = threading.Condition()
+        self._ids = {}
+        self._id_lock = threading.Lock()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._queue)
+
+    def _complete_key(self, entity):
+        if not entity.key.is_partial:
+            return
+        kind = entity.key.kind
+        with self._id_lock:
+            ids = self._ids.get(kind)
+            if not ids:
+                ids = self._ids[kind] = collections.deque(self.client.allocate_ids(self.client.key(kind), ID_BLOCK))
+            entity.key = entity.key.completed_key(ids.popleft().id)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    # Queues the entity and returns its id, which is assigned up front, or
+    # None if the entity was dropped or could not be written.
+    def put(self, entity):
+        if self.max_entries <= 0:
+            return entity.key.id if self._write([entity]) else None
+        self._complete_key(entity)
+        with self._condition:
+            if not self._closed:
+                self._start()
+                if len(self._queue) >= self.max_entries and self.overflow == "block":
+                    self._condition.wait_for(lambda: len(self._queue) < self.max_entries or self._closed,
+                                             self.block_timeout)
+                if len(self._queue) < self.max_entries and not self._closed:
+                    self._queue.append((time.monotonic(), entity))
+                    if len(self._queue) >= self.batch_size:
+                        self._condition.notify_all()
+                    return entity.key.id
+                if self.overflow == "drop":
+                    _record([entity], "dropped")
+                    return None
+        return entity.key.id if self._write([entity]) else None
+
+    # The queued or in-flight entity with this key, if it isn't written yet.
+    def get(self, key):
+        with self._condition:
+            for _, entity in reversed(self._queue):
+                if entity.key == key:
+                    return copy.deepcopy(entity)
+            for batch in self._writing.values():
+                for entity in batch:
+                    if entity.key == key:
+                        return copy.deepcopy(entity)
+        return None
+
+    def _take(self, count):
+        batch = [self._queue.popleft()[1] for _ in range(min(count, len(self._queue)))]
+        if not batch:
+            return None, batch
+        self._batches += 1
+        self._writing[self._batches] = batch
+        self._condition.notify_all()
+        return self._batches, batch
+
+    def _done(self, number):
+        with self._condition:
+            del self._writing[number]
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and len(self._queue) < self.batch_size:
+                    if not self._queue:
+                        self._condition.wait()
+                        continue
+                    remaining = self._queue[0][0] + self.flush_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._closed and not self._queue:
+                    return
+                number, batch = self._take(self.batch_size)
+            try:
+                self._write(batch)
+            finally:
+                self._done(number)
+
+    def _write(self, entities):
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                batching.put_multi(self.client, entities)
+            except Exception:
+                if attempt == WRITE_ATTEMPTS - 1:
+                    logger.exception("Dropping %d buffered writes", len(entities))
+                    _record(entities, "failed")
+                    return False
+                time.sleep(RETRY_DELAY * 2 ** attempt)
+            else:
+                _record(entities, "written")
+                return True
+
+    # Writes what was queued before the call and waits up to `timeout` for
+    # batches already being written, so a read that follows sees them.
+    # Entities queued while it runs are left to the background thread.
+    # Returns whether everything queued before the call was written.
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        with self._condition:
+            earlier = set(self._writing)
+            number, batch = self._take(len(self._queue))
+        written = True
+        if batch:
+            try:
+                written = self._write(batch)
+            finally:
+                self._done(number)
+        with self._condition:
+            return self._condition.wait_for(lambda: not earlier & set(self._writing), timeout) and written
+
+    def close(self, timeout=10.0):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush(timeout)